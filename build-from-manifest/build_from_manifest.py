@@ -25,6 +25,8 @@ from pathlib import Path
 from subprocess import PIPE, STDOUT
 from typing import Union
 
+from manifest_util import diff_manifests, get_ignore_projects
+
 
 # Context manager for handling a given set of code/commands
 # being run from a given directory on the filesystem
@@ -66,9 +68,23 @@ class ManifestBuilder:
         'build-manifest.xml',
         'source.tar',
         'source.tar.gz',
+        'source.tar.zst',
         'CHANGELOG'
     ]
 
+    # Commands to compress the source tarball, reading the tar stream on
+    # stdin; both use all available cores and are deterministic in their
+    # output regardless of the number of threads used
+    compressors = {
+        'gzip': ('source.tar.gz', ['pigz', '--no-name', '--stdout']),
+        'zstd': ('source.tar.zst', ['zstd', '-T0', '-q', '--stdout']),
+    }
+
+    # Fixed mtime given to everything in the source tarball, so identical
+    # syncs produce identical tarballs. 1980-01-01 rather than the epoch,
+    # as zip (and so Python wheel builds) can't handle earlier dates
+    tarball_mtime = 315532800
+
     def __init__(self, args):
         """
         Initialize from the arguments and set up a set of additional
@@ -81,6 +97,7 @@ class ManifestBuilder:
         self.build_manifests_org = args.build_manifests_org
         self.force = args.force
         self.push = not args.no_push
+        self.source_compression = args.source_compression
 
         self.output_files = dict()
         self.product = None
@@ -104,6 +121,7 @@ class ManifestBuilder:
         self.release = None
         self.last_build_num = 0
         self.build_num = None
+        self.synced_manifest = None
         self.util_dir = pathlib.Path(__file__).parent.parent / "utilities"
 
     def prepare_files(self):
@@ -382,6 +400,18 @@ class ManifestBuilder:
 
             self.build_num = max(self.last_build_num + 1, self.start_build)
 
+    def get_synced_manifest(self):
+        """
+        Return the output of 'repo manifest -r' for the current sync,
+        only running it the first time it's needed
+        """
+
+        if self.synced_manifest is None:
+            self.synced_manifest = run(['repo', 'manifest', '-r'],
+                                       check=True, stdout=PIPE).stdout
+
+        return self.synced_manifest
+
     def check_for_changes(self):
         """
         Check if there have been changes since the previous build.
@@ -395,12 +425,14 @@ class ManifestBuilder:
         """
 
         if self.build_manifest_filename.exists():
-            chk_result = run([
-                f"{script_dir}/manifest-unchanged",
-                "--repo-sync", ".",
-                "--build-manifest", self.build_manifest_filename,
-            ])
-            if chk_result.returncode == 0:
+            changes = diff_manifests(
+                self.build_manifest_filename,
+                EleTree.ElementTree(
+                    EleTree.fromstring(self.get_synced_manifest())
+                ),
+                get_ignore_projects(self.manifest_config)
+            )
+            if not changes:
                 if not self.force:
                     print('*\n*\n*\n***** No changes since '
                           f'{self.product} {self.release} '
@@ -455,8 +487,8 @@ class ManifestBuilder:
 
         print(f'Updating build manifest {self.build_manifest_filename}')
 
-        with open(self.build_manifest_filename, 'w') as fh:
-            run(['repo', 'manifest', '-r'], check=True, stdout=fh)
+        with open(self.build_manifest_filename, 'wb') as fh:
+            fh.write(self.get_synced_manifest())
 
         last_build_manifest = EleTree.parse(self.build_manifest_filename)
 
@@ -540,68 +572,121 @@ class ManifestBuilder:
                 else:
                     fh.write(f'{key}={value}\n')
 
+    def normalize_tarinfo(self, tarinfo):
+        """
+        Strip the details of the local filesystem that would otherwise
+        differ between identical syncs from a tarball entry
+        """
+
+        tarinfo.mtime = self.tarball_mtime
+        tarinfo.uid = tarinfo.gid = 0
+        tarinfo.uname = tarinfo.gname = ''
+        return tarinfo
+
+    def add_tree_to_tarball(self, tar_fh, keep_git):
+        """
+        Walk the current directory in sorted order, adding everything
+        except the .repo information to the tarball. .git directories are
+        only included if keep_git is set.
+        """
+
+        for root, dirs, files in os.walk('.'):
+            dirs.sort()
+            for name in sorted(files):
+                tar_fh.add(os.path.join(root, name)[2:], recursive=False,
+                           filter=self.normalize_tarinfo)
+            for name in list(dirs):
+                path = os.path.join(root, name)[2:]
+                if name == '.repo':
+                    dirs.remove(name)
+                elif name == '.git':
+                    dirs.remove(name)
+                    if keep_git:
+                        self.add_git_dir_to_tarball(tar_fh, path)
+                else:
+                    tar_fh.add(path, recursive=False,
+                               filter=self.normalize_tarinfo)
+
+    def add_git_dir_to_tarball(self, tar_fh, git_dir):
+        """
+        Add a .git directory to the tarball. Symlinks are dereferenced so
+        that the resulting .git directories work on Windows. Because of
+        this, we don't save the .repo directory also, as that would
+        double the size of the tarball since mostly .repo just contains
+        git dirs.
+        """
+
+        tar_fh.dereference = True
+        try:
+            tar_fh.add(git_dir, recursive=False, filter=self.normalize_tarinfo)
+            for root, dirs, files in os.walk(git_dir, followlinks=True):
+                dirs.sort()
+                for name in sorted(files):
+                    # Git (or repo) sometimes creates broken symlinks,
+                    # like "shallow", and Python's tarfile module chokes
+                    # on those
+                    if os.path.exists(os.path.join(root, name)):
+                        tar_fh.add(os.path.join(root, name), recursive=False,
+                                   filter=self.normalize_tarinfo)
+                for name in dirs:
+                    tar_fh.add(os.path.join(root, name), recursive=False,
+                               filter=self.normalize_tarinfo)
+        finally:
+            tar_fh.dereference = False
+
     def create_tarball(self):
         """
         Create the source tarball from the repo sync and generated
         files (new manifest and CHANGELOG).  Avoid copying the .repo
         information, and only copy the .git directory if specified.
+
+        The tar stream is written straight into a parallel compressor
+        (pigz or zstd) in a single pass over the tree, with entries
+        sorted and ownership and timestamps normalized, so the same
+        sync always produces the same tarball.
         """
 
         # Exit early if requested to skip tarball creation
         if not self.manifest_config.get('create_source_tarball', True):
-            print(f'Skipping creation of source.tar.gz')
+            print(f'Skipping creation of source tarball')
             return
 
-        tarball_filename = self.output_files['source.tar']
-        targz_filename = self.output_files['source.tar.gz']
+        output_name, compress_cmd = \
+            self.compressors[self.source_compression]
+        output_filename = self.output_files[output_name]
+        keep_git = self.manifest_config.get('keep_git', False)
 
-        print(f'Creating {tarball_filename}')
+        print(f'Creating {output_filename}')
+        if keep_git:
+            print(f'Including Git files in {output_filename}')
         product_dir = pathlib.Path(self.product_path)
 
-        with pushd(product_dir):
-            with tarfile.open(tarball_filename, 'w') as tar_fh:
-                for root, dirs, files in os.walk('.'):
-                    for name in files:
-                        tar_fh.add(os.path.join(root, name)[2:])
-                    for name in dirs:
-                        if name == '.repo' or name == '.git':
-                            dirs.remove(name)
-                        else:
-                            tar_fh.add(os.path.join(root, name)[2:],
-                                       recursive=False)
-
-            if self.manifest_config.get('keep_git', False):
-                print(f'Adding Git files to {tarball_filename}')
-                # When keeping git files, need to dereference symlinks
-                # so that the resulting .git directories work on Windows.
-                # Because of this, we don't save the .repo directory
-                # also, as that would double the size of the tarball
-                # since mostly .repo just contains git dirs.
-                with tarfile.open(tarball_filename, "a",
-                                  dereference=True) as tar:
-                    for root, dirs, files in os.walk('.', followlinks=True):
-                        for name in dirs:
-                            if name == '.repo':
-                                dirs.remove(name)
-                            elif name == '.git':
-                                tar.add(os.path.join(root, name)[2:],
-                                        recursive=False)
-                        if '/.git' in root:
-                            for name in files:
-                                # Git (or repo) sometimes creates broken
-                                # symlinks, like "shallow", and Python's
-                                # tarfile module chokes on those
-                                if os.path.exists(os.path.join(root, name)):
-                                    tar.add(os.path.join(root, name)[2:],
-                                            recursive=False)
-
-        print(f'Compressing {tarball_filename}')
-
-        with open(tarball_filename, 'rb') as f_in, \
-                gzip.open(targz_filename, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-
-        os.unlink(tarball_filename)
+        with pushd(product_dir), open(output_filename, 'wb') as out_fh:
+            if shutil.which(compress_cmd[0]) is None:
+                if self.source_compression != 'gzip':
+                    print(f'\n\nError: {compress_cmd[0]} not found!')
+                    sys.exit(5)
+
+                # Fall back to compressing in-process; still a single
+                # streaming pass, just not a parallel one
+                print(f'{compress_cmd[0]} not found, using Python gzip')
+                with gzip.GzipFile(filename='', mode='wb', fileobj=out_fh,
+                                   mtime=0) as gz_fh, \
+                        tarfile.open(fileobj=gz_fh, mode='w|') as tar_fh:
+                    self.add_tree_to_tarball(tar_fh, keep_git)
+                return
+
+            proc = Popen(compress_cmd, stdin=PIPE, stdout=out_fh)
+            try:
+                with tarfile.open(fileobj=proc.stdin, mode='w|') as tar_fh:
+                    self.add_tree_to_tarball(tar_fh, keep_git)
+            finally:
+                proc.stdin.close()
+                proc.wait()
+
+            if proc.returncode != 0:
+                print(f'\n\nError {proc.returncode} running {compress_cmd[0]}!')
+                sys.exit(5)
 
     def generate_final_files(self):
         """
@@ -677,6 +762,11 @@ def parse_args():
                              'are no repo changes')
     parser.add_argument('--no-push', action='store_true',
                         help='Do not push final build manifest')
+    parser.add_argument('--source-compression', default='gzip',
+                        choices=sorted(ManifestBuilder.compressors),
+                        help='Compression for the source tarball: gzip '
+                             'produces source.tar.gz, zstd produces '
+                             'source.tar.zst (default: gzip)')
     parser.add_argument('manifest', help='Path to input manifest')
 
     args = parser.parse_args()
@@ -7,9 +7,12 @@ import os
 import pprint
 import re
 import sys
+import tempfile
 import xml.etree.ElementTree as ET
 
-from subprocess import check_call, check_output
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import check_call, check_output, CalledProcessError, DEVNULL
+from subprocess import run, PIPE, TimeoutExpired
 
 
 @contextlib.contextmanager
@@ -20,6 +23,130 @@ def remember_cwd():
     finally:
         os.chdir(curdir)
 
+class ManifestMetadata(dict):
+    """
+    Metadata about a single manifest. The parsed manifest ElementTree is
+    available under the key "_manifest", but is only read from disk the
+    first time it is asked for, so scanning the whole manifest repository
+    doesn't mean holding every manifest in memory.
+    """
+
+    def __init__(self, metadata, manifest_file):
+        super().__init__(metadata)
+        self.manifest_file = manifest_file
+
+    def __missing__(self, key):
+        if key != '_manifest':
+            raise KeyError(key)
+        root = ET.parse(self.manifest_file)
+        self['_manifest'] = root
+        return root
+
+    def get(self, key, default=None):
+        if key == '_manifest':
+            return self['_manifest']
+        return super().get(key, default)
+
+
+class ManifestCache:
+    """
+    Persistent record of the metadata extracted from the contents of each
+    manifest, keyed by git blob SHA, so a manifest is only parsed again
+    when it changes. The cache lives in the manifest repository's git dir.
+    If manifest_dir is not a git checkout, nothing is cached.
+    """
+
+    filename = "manifest_util-cache.json"
+    cache_version = 1
+
+    def __init__(self, manifest_dir):
+        self.path = None
+        self.blobs = {}
+        self.entries = {}
+        self.dirty = False
+
+        try:
+            git_dir = check_output(
+                ["git", "rev-parse", "--absolute-git-dir"],
+                cwd=manifest_dir, stderr=DEVNULL, text=True
+            ).strip()
+            tree = check_output(
+                ["git", "ls-tree", "-r", "-z", "HEAD"],
+                cwd=manifest_dir, stderr=DEVNULL, text=True
+            )
+            # Anything differing from HEAD in the working tree has no
+            # committed blob to key on, so is always parsed afresh
+            modified = check_output(
+                ["git", "diff-index", "--relative", "--name-only", "-z",
+                 "HEAD"],
+                cwd=manifest_dir, stderr=DEVNULL, text=True
+            ).split('\0')
+        except (CalledProcessError, OSError):
+            return
+
+        for entry in tree.split('\0'):
+            if not entry:
+                continue
+            info, path = entry.split('\t', 1)
+            _, objtype, sha = info.split()
+            if objtype == 'blob' and path not in modified:
+                self.blobs[path] = sha
+
+        self.path = os.path.join(git_dir, self.filename)
+        try:
+            with open(self.path, "r") as cachefile:
+                cache = json.load(cachefile)
+            if cache.get("version") == self.cache_version:
+                self.entries = cache["manifests"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def get(self, manifest_path):
+        """
+        Returns the cached metadata for the current contents of the
+        given manifest, or None
+        """
+        sha = self.blobs.get(manifest_path)
+        if sha is None:
+            return None
+        return self.entries.get(sha)
+
+    def put(self, manifest_path, metadata):
+        """
+        Records the metadata extracted from the current contents of the
+        given manifest
+        """
+        sha = self.blobs.get(manifest_path)
+        if sha is not None:
+            self.entries[sha] = metadata
+            self.dirty = True
+
+    def save(self):
+        """
+        Writes the cache back out, dropping entries for blobs no longer
+        in the manifest repository
+        """
+        if self.path is None:
+            return
+        current = set(self.blobs.values())
+        stale = [sha for sha in self.entries if sha not in current]
+        if not self.dirty and not stale:
+            return
+        for sha in stale:
+            del self.entries[sha]
+
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.path), prefix=self.filename
+        )
+        with os.fdopen(fd, "w") as cachefile:
+            json.dump({
+                "version": self.cache_version,
+                "manifests": self.entries
+            }, cachefile)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
 def get_manifest_dir(manifest_repo):
     """
     Given a URL to a manifest repository, return the local path that
@@ -31,19 +158,18 @@ def get_manifest_dir(manifest_repo):
         re.sub(r'[:/& ?]', '_', manifest_repo)
     )
 
-def scan_manifests(manifest_repo="ssh://git@github.com/couchbase/manifest"):
+def sync_manifest_repo(manifest_repo="ssh://git@github.com/couchbase/manifest"):
     """
     Syncs to the "manifest" project from the given repository, and
-    returns a list of metadata about all discovered manifests. This does
-    leave things in a "manifest" subdir of the current working
-    directory.
+    returns the path to the local clone. This does leave things in a
+    "manifest" subdir of the current working directory.
 
     If manifest_repo is a local path, uses it directly without cloning.
     """
     # Check if manifest_repo is a local directory path
     if os.path.isdir(manifest_repo):
         print(f"Using existing local manifest directory: {manifest_repo}")
-        return get_metadata_for_products(manifest_repo)
+        return manifest_repo
 
     # Sync manifest project into local directory based on mangled URL
     os.makedirs("manifest", exist_ok=True)
@@ -57,7 +183,18 @@ def scan_manifests(manifest_repo="ssh://git@github.com/couchbase/manifest"):
         check_call(["git", "fetch", "--all"])
         check_call(["git", "reset", "--hard", "origin/HEAD"])
 
-    return get_metadata_for_products(manifest_dir)
+    return manifest_dir
+
+def scan_manifests(manifest_repo="ssh://git@github.com/couchbase/manifest"):
+    """
+    Syncs to the "manifest" project from the given repository, and
+    returns a list of metadata about all discovered manifests. This does
+    leave things in a "manifest" subdir of the current working
+    directory.
+
+    If manifest_repo is a local path, uses it directly without cloning.
+    """
+    return get_metadata_for_products(sync_manifest_repo(manifest_repo))
 
 def get_metadata_for_products(manifest_dir):
     """
@@ -68,6 +205,7 @@ def get_metadata_for_products(manifest_dir):
     """
     # Scan the current directory for input manifests.
     manifests = {}
+    cache = ManifestCache(manifest_dir)
     with remember_cwd():
         os.chdir(manifest_dir)
         for root, dirs, files in os.walk("."):
@@ -86,10 +224,12 @@ def get_metadata_for_products(manifest_dir):
                 # Strip leading "./" from root (pass character 2 onwards)
                 prod_manifests = _get_metadata_for_product(
                     os.getcwd(),
-                    root[2:]
+                    root[2:],
+                    cache
                 )
                 manifests.update(prod_manifests)
 
+    cache.save()
     return manifests
 
 
@@ -107,30 +247,32 @@ def _load_product_config(manifest_dir, product_path):
     return (config["manifests"], config.get("product", None))
 
 
-def _get_metadata_for_product(manifest_dir, product_path):
+def _get_metadata_for_product(manifest_dir, product_path, cache=None):
     """
     Loads metadata about all manifests in a given product subdir
     manifest_dir: root of a manifest repository.
     product_path: relative path to subdir of repository. Subdir
     is presumed to have a "product-config.json" at the root.
+    cache: optional ManifestCache for the manifest repository
     returns: dict (keyed by manifest paths) of dicts of metadata
     """
 
     config, override_product = _load_product_config(manifest_dir, product_path)
-    prod_metadata = config.items()
-    for manifest_path, metadata in prod_metadata:
-        _append_manifest_metadata(
-            metadata, manifest_dir, manifest_path, product_path, override_product
+    return {
+        manifest_path: _append_manifest_metadata(
+            metadata, manifest_dir, manifest_path, product_path,
+            override_product, cache
         )
-    return prod_metadata
+        for manifest_path, metadata in config.items()
+    }
 
 
-def _append_manifest_metadata(metadata, manifest_dir, manifest_path, product_path, override_product):
+def _append_manifest_metadata(metadata, manifest_dir, manifest_path, product_path, override_product, cache=None):
     """
     Extends a manifest-specific dict with additional metadata derived
     from the product path, product-config, and manifest contents.
-    Also saves the full manifest ElementTree root in the metadata with
-    the key "_manifest".
+    The full manifest ElementTree root is available in the returned
+    metadata with the key "_manifest", loaded on first access.
     metadata: input dict to extend
     manifest_dir: root of manifest repository checkout
     manifest_path: path (relative to manifest_dir) to a manifest.xml
@@ -138,6 +280,9 @@ def _append_manifest_metadata(metadata, manifest_dir, manifest_path, product_pat
     a product-config.json)
     override_product: if product-config.json has a top-level "product" key,
     that value; otherwise None
+    cache: optional ManifestCache; the manifest is only parsed if the
+    cache has nothing for its current contents
+    returns: ManifestMetadata
     """
 
     if override_product is not None:
@@ -147,13 +292,24 @@ def _append_manifest_metadata(metadata, manifest_dir, manifest_path, product_pat
         # Otherwise, product name is derived from product path
         product = product_path.replace('/', '::')
 
-    # Have to actually parse the manifest to extract VERSION
-    root = ET.parse(os.path.join(manifest_dir, manifest_path))
-    verattr = root.find('project[@name="build"]/annotation[@name="VERSION"]')
-    if verattr is not None:
-        metadata['version'] = verattr.get('value', "0.0.0")
-    else:
-        metadata['version'] = "0.0.0"
+    metadata = ManifestMetadata(
+        metadata,
+        os.path.join(os.path.abspath(manifest_dir), manifest_path)
+    )
+
+    # Have to actually parse the manifest to extract VERSION, unless
+    # it's unchanged since it was last parsed
+    extracted = cache.get(manifest_path) if cache is not None else None
+    if extracted is None:
+        root = ET.parse(metadata.manifest_file)
+        verattr = root.find('project[@name="build"]/annotation[@name="VERSION"]')
+        if verattr is not None:
+            extracted = {'version': verattr.get('value', "0.0.0")}
+        else:
+            extracted = {'version': "0.0.0"}
+        if cache is not None:
+            cache.put(manifest_path, extracted)
+    metadata.update(extracted)
 
     # Derived values are here
     metadata['product'] = product
@@ -161,7 +317,7 @@ def _append_manifest_metadata(metadata, manifest_dir, manifest_path, product_pat
     metadata['manifest_path'] = manifest_path
     metadata['prod_name'] = product.split('::')[-1]
     metadata['build_job'] = metadata.get('jenkins_job', f'{product}-build')
-    metadata['_manifest'] = root
+    return metadata
 
 
 def get_metadata_for_manifest(manifest_dir, manifest_path):
@@ -181,9 +337,224 @@ def get_metadata_for_manifest(manifest_dir, manifest_path):
             print (f"No product-config.json found above {manifest_path}!")
             sys.exit(1)
     config, override_product = _load_product_config(manifest_dir, product_path)
-    metadata = config[manifest_path]
-    _append_manifest_metadata(metadata, manifest_dir, manifest_path, product_path, override_product)
-    return metadata
+    return _append_manifest_metadata(
+        config[manifest_path], manifest_dir, manifest_path, product_path,
+        override_product
+    )
+
+
+
+# Projects whose revisions never, by themselves, warrant a new build
+DEFAULT_IGNORE_PROJECTS = [
+    'testrunner',
+    'product-metadata',
+    'product-texts',
+    'golang',
+    'mobile-testkit',
+]
+
+
+def get_ignore_projects(metadata):
+    """
+    Returns the list of projects whose changes should not trigger a new
+    build of a manifest: the defaults plus any "ignore_projects" from the
+    manifest's product-config.json entry. These are regular expressions
+    matched against project paths - see diff_manifests()
+    metadata: dict of metadata (or product-config entry) for the manifest
+    """
+    return DEFAULT_IGNORE_PROJECTS + list(metadata.get('ignore_projects', []))
+
+
+def get_project_revisions(manifest):
+    """
+    Returns the revision of every project in a manifest
+    manifest: path to a manifest file, or an already-parsed ElementTree
+    returns: dict (keyed by project path) of (project name, revision)
+    """
+    if not isinstance(manifest, ET.ElementTree):
+        manifest = ET.parse(manifest)
+    root = manifest.getroot()
+
+    default = root.find('default')
+    default_revision = default.get('revision') if default is not None else None
+
+    revisions = {}
+    for project in root.iter('project'):
+        name = project.get('name')
+        revisions[project.get('path', name)] = (
+            name, project.get('revision', default_revision)
+        )
+    return revisions
+
+
+def diff_manifests(old_manifest, new_manifest, ignore_projects=()):
+    """
+    Compares the projects of two manifests, which should both be fully
+    resolved (eg. the output of 'repo manifest -r', or a build manifest).
+    As with 'repo diffmanifests --raw', a project is "changed" if it is
+    in both manifests at different revisions. Changes to projects whose
+    path matches one of ignore_projects are left out; those projects
+    being added or removed is still reported.
+    old_manifest, new_manifest: paths to manifests, or ElementTrees
+    ignore_projects: regular expressions for the paths of projects whose
+    revisions don't matter. As with the regex manifest-unchanged used to
+    apply to 'repo diffmanifests --raw' output, each must match the
+    whole path
+    returns: dict (keyed by project path) of (project name, old revision,
+    new revision); the old revision is None for added projects, and the
+    new revision is None for removed projects
+    """
+    return diff_revisions(
+        get_project_revisions(old_manifest),
+        get_project_revisions(new_manifest),
+        ignore_projects
+    )
+
+
+def diff_revisions(old, new, ignore_projects=()):
+    """
+    Compares two sets of project revisions, as returned by
+    get_project_revisions() or get_remote_revisions(). See diff_manifests().
+    """
+    ignore_re = re.compile('(?:' + '|'.join(ignore_projects) + ')') \
+        if ignore_projects else None
+
+    changes = {}
+    for path, (name, old_revision) in old.items():
+        if path not in new:
+            changes[path] = (name, old_revision, None)
+            continue
+        new_revision = new[path][1]
+        if new_revision == old_revision:
+            continue
+        if ignore_re is None or not ignore_re.fullmatch(path):
+            changes[path] = (name, old_revision, new_revision)
+    for path, (name, new_revision) in new.items():
+        if path not in old:
+            changes[path] = (name, None, new_revision)
+    return changes
+
+
+def _read_manifest_projects(manifest_dir, manifest_path, remotes, defaults,
+                            projects):
+    """
+    Adds the remotes and projects of a manifest to the given dicts,
+    following <include>s. Returns False if the manifest uses anything
+    else that would change which projects are synced, or from where.
+    """
+    root = ET.parse(os.path.join(manifest_dir, manifest_path)).getroot()
+    for elem in root:
+        if elem.tag == 'remote':
+            remotes[elem.get('name')] = elem
+        elif elem.tag == 'default':
+            defaults.update(elem.attrib)
+        elif elem.tag == 'include':
+            if not _read_manifest_projects(
+                manifest_dir, elem.get('name'), remotes, defaults, projects
+            ):
+                return False
+        elif elem.tag == 'project':
+            projects.append(elem)
+        elif elem.tag in ('remove-project', 'extend-project', 'submanifest'):
+            return False
+    return True
+
+
+def get_manifest_projects(manifest_dir, manifest_path):
+    """
+    Works out where every project in an input manifest is fetched from,
+    and which revision of it a sync would use.
+    manifest_dir: root of a manifest repository checkout
+    manifest_path: path (relative to manifest_dir) to a manifest.xml
+    returns: dict (keyed by project path) of (project name, fetch URL,
+    revision), or None if the manifest can't be resolved this way
+    """
+    remotes = {}
+    defaults = {}
+    elems = []
+    if not _read_manifest_projects(
+        manifest_dir, manifest_path, remotes, defaults, elems
+    ):
+        return None
+
+    projects = {}
+    for elem in elems:
+        name = elem.get('name')
+        remote = remotes.get(elem.get('remote', defaults.get('remote')))
+        if remote is None:
+            return None
+        fetch = remote.get('fetch', '')
+        # Relative fetch URLs are relative to the manifest repository's
+        # own URL, which we don't know here
+        if '://' not in fetch and not fetch.startswith('/'):
+            return None
+        revision = elem.get(
+            'revision', remote.get('revision', defaults.get('revision'))
+        )
+        if revision is None:
+            return None
+        projects[elem.get('path', name)] = (
+            name, f"{fetch.rstrip('/')}/{name}", revision
+        )
+    return projects
+
+
+def _ls_remote(url, revision):
+    """
+    Returns the SHA a branch or tag currently points to in a remote
+    repository, or None if that can't be determined
+    """
+    if re.fullmatch(r'[0-9a-f]{40}', revision):
+        return revision
+    if revision.startswith('refs/'):
+        refs = [revision]
+    else:
+        refs = [f'refs/heads/{revision}', f'refs/tags/{revision}']
+
+    # Ask for the peeled form of any annotated tag as well
+    patterns = refs + [f'{ref}^{{}}' for ref in refs]
+    try:
+        result = run(
+            ['git', 'ls-remote', url] + patterns,
+            stdout=PIPE, stderr=DEVNULL, text=True, timeout=120
+        )
+    except (OSError, TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+
+    heads = dict(
+        reversed(line.split('\t', 1)) for line in result.stdout.splitlines()
+    )
+    # Annotated tags are recorded in build manifests as the commit
+    # they point to
+    for ref in refs:
+        sha = heads.get(f'{ref}^{{}}', heads.get(ref))
+        if sha is not None:
+            return sha
+    return None
+
+
+def get_remote_revisions(projects, jobs=16):
+    """
+    Resolves the current SHA of every project from its remote, without
+    syncing anything, using parallel 'git ls-remote' calls.
+    projects: as returned by get_manifest_projects()
+    jobs: number of ls-remote calls to run at once
+    returns: dict (keyed by project path) of (project name, SHA), in the
+    same form as get_project_revisions(), or None if any project couldn't
+    be resolved
+    """
+    paths = list(projects)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        shas = list(executor.map(
+            lambda path: _ls_remote(*projects[path][1:]), paths
+        ))
+    if None in shas:
+        return None
+    return {
+        path: (projects[path][0], sha) for path, sha in zip(paths, shas)
+    }
 
 
 if __name__ == '__main__':
@@ -11,7 +11,7 @@ import logging
 import os
 import shutil
 import sys
-from src.wrappers.registry import analyze_images
+from src.wrappers.registry import analyze_images, DEFAULT_JOBS_PER_REGISTRY
 from src.wrappers.logging import setup_logging
 from src.wrappers.collections import defaultdict
 from src.wrappers import git
@@ -116,6 +116,13 @@ def main() -> int:
         help="Registry(s) - a registry or comma separated list of registries "
         "(dockerhub and/or rhcc)"
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of tags to analyze concurrently on each registry",
+        default=DEFAULT_JOBS_PER_REGISTRY
+    )
 
     args = parser.parse_args()
     logging.getLogger().setLevel(args.log_level.upper())
@@ -144,7 +151,8 @@ def main() -> int:
         registries=registries,
         products=products,
         editions=editions,
-        versions=versions
+        versions=versions,
+        jobs=args.jobs
     )
 
     # Ensure triggers directory exists and is empty
@@ -1,6 +1,8 @@
 import logging
 import subprocess
+import threading
 import time
+from collections import defaultdict
 from typing import List, Tuple, Dict, Optional
 
 logger = logging.getLogger(__name__)
@@ -9,6 +11,12 @@ logger = logging.getLogger(__name__)
 # Format: {image_uri: (updates_needed, packages_to_update)}
 _package_update_cache: Dict[str, Tuple[bool, List[str]]] = {}
 
+# Per-image locks, so that when several tags share a base image and are
+# checked concurrently, only the first pulls and runs it and the rest wait
+# for its cached result
+_package_update_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+_package_update_locks_lock = threading.Lock()
+
 
 def pull_image(image_uri: str, max_retries: int = 3) -> None:
     """
@@ -417,6 +425,18 @@ def check_image_for_updates(image_uri: str, image_label: str = "image") -> Tuple
         RuntimeError: If image pull or container start fails
         RuntimeError: If apt update fails for containers using apt
     """
+    with _package_update_locks_lock:
+        image_lock = _package_update_locks[image_uri]
+
+    with image_lock:
+        return _check_image_for_updates(image_uri, image_label)
+
+
+def _check_image_for_updates(image_uri: str, image_label: str) -> Tuple[bool, List[str]]:
+    """
+    Does the work of check_image_for_updates() - callers must hold the
+    lock for image_uri
+    """
     # Check cache first
     if image_uri in _package_update_cache:
         logger.debug(f"Using cached package update results for {image_label} {image_uri}")
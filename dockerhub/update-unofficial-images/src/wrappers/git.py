@@ -1,31 +1,23 @@
 import logging
 import os
-from contextlib import contextmanager
+import threading
+from functools import lru_cache
 from subprocess import DEVNULL, CalledProcessError, check_output, run
-from typing import Generator
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 repos = {}
-
-
-@contextmanager
-def chdir(path: str) -> Generator[None, None, None]:
-    logger.debug(f"Changing directory to {path}")
-    original_path = os.getcwd()
-    try:
-        os.chdir(path)
-        yield
-    finally:
-        logger.debug(f"Changing directory back to {original_path}")
-        os.chdir(original_path)
+_repos_lock = threading.Lock()
 
 
 def repo(repo: str, branch: str = None) -> 'Repo':
     logger.debug(f"Getting repo instance for {repo} (branch: {branch})")
-    if repo not in repos:
-        logger.debug(f"Creating new repo instance for {repo}")
-        repos[repo] = Repo(repo, branch)
-    return repos[repo]
+    # Held while cloning, so two threads can't clone the same repo at once
+    with _repos_lock:
+        if repo not in repos:
+            logger.debug(f"Creating new repo instance for {repo}")
+            repos[repo] = Repo(repo, branch)
+        return repos[repo]
 
 
 class Repo:
@@ -64,51 +56,77 @@ class Repo:
             logger.error(f"Failed to clone repository {self.repo}: {e}")
             raise
 
-    def checkout_timestamp(self, timestamp: str, branch: str = "master") -> None:
-        logger.debug(
-            f"Checking out {self.repo} at timestamp {timestamp} on branch {branch}")
-        try:
-            with chdir(self.local_path):
-                logger.debug("Resetting repository state")
-                run(["git", "reset", "--hard", "HEAD"],
-                    stdout=DEVNULL,
-                    stderr=DEVNULL)
-                run(["git", "clean", "-fd"],
-                    stdout=DEVNULL,
-                    stderr=DEVNULL)
-
-                logger.debug(f"Finding commit before timestamp {timestamp}")
-                sha = check_output(
-                    ['git', 'rev-list', '-n', '1', '--before', timestamp, branch],
-                    stderr=DEVNULL).strip().decode('utf-8')
-                if not sha:
-                    logger.warning(f"No commit found before timestamp {timestamp}")
-                    return
-                logger.debug(f"Found commit SHA {sha}")
-
-                run(["git", "checkout", sha], stderr=DEVNULL)
-                return sha
-        except CalledProcessError as e:
-            logger.error(f"Failed to checkout at timestamp {timestamp}: {e}")
-            raise
+    def show(self, revision: str, path: str) -> Optional[str]:
+        """
+        Read a file as of a given revision straight from the object store,
+        leaving the working tree alone. Returns None if the file doesn't
+        exist at that revision.
+        """
+        return _show(self.local_path, revision, path)
+
+    def last_commit_timestamp(self, path: str,
+                              revision: str = "HEAD") -> Optional[str]:
+        """
+        Get the commit timestamp of the last change to a path as of a given
+        revision, or None if the path has no history
+        """
+        logger.debug(f"Finding last commit to {path} in {self.repo}")
+        timestamp = check_output(
+            ["git", "log", "-1", "--format=%ct", revision, "--", path],
+            cwd=self.local_path,
+            stderr=DEVNULL).strip().decode('utf-8')
+        return timestamp or None
+
+    def revision_before(self, timestamp: str,
+                        branch: str = "HEAD") -> Optional[str]:
+        """
+        Get the SHA of the last commit on a branch before a given timestamp,
+        or None if there isn't one
+        """
+        logger.debug(f"Finding commit before timestamp {timestamp} in {self.repo}")
+        sha = check_output(
+            ['git', 'rev-list', '-n', '1', '--before', timestamp, branch],
+            cwd=self.local_path,
+            stderr=DEVNULL).strip().decode('utf-8')
+        return sha or None
 
     def checkout(self, revision: str) -> None:
         logger.debug(f"Checking out revision {revision} on {self.repo}")
         try:
-            with chdir(self.local_path):
-                logger.debug("Resetting repository state")
-                run(["git", "reset", "--hard", "HEAD"],
-                    stdout=DEVNULL,
-                    stderr=DEVNULL)
-                run(["git", "clean", "-fd"],
-                    stdout=DEVNULL,
-                    stderr=DEVNULL)
-
-                logger.debug(f"Checking out revision {revision}")
-                run(["git", "checkout", revision],
-                    stdout=DEVNULL,
-                    stderr=DEVNULL)
-                logger.debug(f"Successfully checked out revision {revision}")
+            logger.debug("Resetting repository state")
+            run(["git", "reset", "--hard", "HEAD"],
+                cwd=self.local_path,
+                stdout=DEVNULL,
+                stderr=DEVNULL)
+            run(["git", "clean", "-fd"],
+                cwd=self.local_path,
+                stdout=DEVNULL,
+                stderr=DEVNULL)
+
+            logger.debug(f"Checking out revision {revision}")
+            run(["git", "checkout", revision],
+                cwd=self.local_path,
+                stdout=DEVNULL,
+                stderr=DEVNULL)
+            logger.debug(f"Successfully checked out revision {revision}")
         except CalledProcessError as e:
             logger.error(f"Failed to checkout revision {revision}: {e}")
             raise
+
+
+@lru_cache(maxsize=None)
+def _show(local_path: str, revision: str, path: str) -> Optional[str]:
+    """
+    Memoized `git show <revision>:<path>` - the same Dockerfile is typically
+    wanted for many tags, and nothing checks out different revisions of the
+    clones while they're being read
+    """
+    logger.debug(f"Reading {revision}:{path} from {local_path}")
+    result = run(["git", "show", f"{revision}:{path}"],
+                 cwd=local_path,
+                 capture_output=True,
+                 text=True)
+    if result.returncode != 0:
+        logger.debug(f"{path} not found at {revision} in {local_path}")
+        return None
+    return result.stdout
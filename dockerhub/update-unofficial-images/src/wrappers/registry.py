@@ -4,6 +4,7 @@ import os
 import re
 import requests
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional
 
@@ -18,9 +19,11 @@ logger = logging.getLogger(__name__)
 
 semver_pattern = r'([0-9]+\.[0-9]+\.[0-9]+)'
 
-# Cache for floating tag digests to avoid repeated inspections
-# Key format: f"{registry}:{product}:{tag}"
-_floating_tag_digest_cache = {}
+# Default number of tags analyzed concurrently on each registry. Nearly all
+# the time spent on a tag is waiting on skopeo, releases.service and docker,
+# so this is about how hard we're willing to hit each registry rather than
+# how many cores we have
+DEFAULT_JOBS_PER_REGISTRY = 4
 
 
 def filter_versions(versions: List[str] = [],
@@ -293,13 +296,9 @@ def get_floating_tags(registry: str, product: str, tag: str, image_info=None) ->
 
     # Use provided image_info if available
     if image_info:
-        target_digest = image_info.raw_info.get(
-            "digest") or image_info.info.get("Digest")
+        target_digest = image_info.digest
     else:
-        # Create a new Image object if we don't have the info
-        image = skopeo.Image(f"{uri}:{tag}")
-        target_digest = image.raw_info.get(
-            "digest") or image.info.get("Digest")
+        target_digest = skopeo.digest(f"{uri}:{tag}")
 
     if not target_digest:
         logger.warning(f"Could not get digest for {uri}:{tag}")
@@ -318,25 +317,11 @@ def get_floating_tags(registry: str, product: str, tag: str, image_info=None) ->
         logger.debug("No floating tags found")
         return []
 
-    # Check each floating tag to see if it matches
+    # Check each floating tag to see if it matches. Only the digest is needed
+    # for this, which skopeo.digest() finds cheaply and remembers for the rest
+    # of the run
     for floating_tag in existing_floating_tags:
-        # Create cache key for this floating tag
-        cache_key = f"{registry}:{product}:{floating_tag}"
-        float_digest = None
-
-        # Try to get digest from cache first
-        if cache_key in _floating_tag_digest_cache:
-            float_digest = _floating_tag_digest_cache[cache_key]
-            logger.debug(f"Using cached digest for {floating_tag}")
-        else:
-            float_image = skopeo.Image(f"{uri}:{floating_tag}")
-            float_digest = float_image.raw_info.get(
-                "digest") or float_image.info.get("Digest")
-
-            # Cache the digest for future use
-            if float_digest:
-                _floating_tag_digest_cache[cache_key] = float_digest
-                logger.debug(f"Cached digest for {floating_tag}")
+        float_digest = skopeo.digest(f"{uri}:{floating_tag}")
 
         if float_digest and float_digest == target_digest:
             matches.append(floating_tag)
@@ -595,12 +580,17 @@ def check_package_updates(registry, product, semver, tag, tag_data):
     return update_data
 
 
-def process_product_edition(registries, product, edition, versions=None):
-    """Process all tags for a specific product/edition combination."""
+def product_edition_tags(registries, product, edition, versions=None):
+    """
+    Find the tags to process for a specific product/edition combination.
+
+    Returns a results dict with an (empty) entry for each registry/product/
+    edition to be processed, along with a list of (registry, semver, tag)
+    for each tag to process, in order.
+    """
     results = defaultdict()
+    work = []
     product_tags = get_product_tags(registries, product, edition)
-    tag_count = 0
-    rebuild_count = 0
 
     for registry in product_tags:
         if registry in registries:
@@ -613,33 +603,29 @@ def process_product_edition(registries, product, edition, versions=None):
 
             for tag in product_tags[registry]:
                 if not versions or any([v in tag for v in versions]):
-                    tag_count += 1
-                    logger.debug(f"Processing tag: {tag}")
+                    logger.debug(f"Queueing tag: {tag}")
                     semver = re.search(semver_pattern, tag).group(1)
-
-                    tag_data = process_single_tag(
-                        registry, product, edition, semver, tag)
-                    results[registry][product][edition][semver] = tag_data
-
-                    if tag_data['rebuild_needed']:
-                        rebuild_count += 1
+                    work.append((registry, semver, tag))
                 else:
                     logger.debug(f"Skipping tag: {tag} - not in versions")
         else:
             logger.debug(f"Skipping registry: {registry} - not in registries")
 
-    return results, tag_count, rebuild_count
+    return results, work
 
 
 def analyze_images(registries: List[str],
                    products: List[str],
                    editions: List[str],
-                   versions: List[str] = None) -> Dict:
+                   versions: List[str] = None,
+                   jobs: int = DEFAULT_JOBS_PER_REGISTRY) -> Dict:
     """
     Retrieve info for any number of registries, products, editions and versions.
 
-    Retrieved info is structured in a dictionary with relevant metadata being
-    stored for each registry/product/edition/version:
+    Tags are processed concurrently, with up to `jobs` tags in flight against
+    each registry at once. Retrieved info is structured in a dictionary with
+    relevant metadata being stored for each registry/product/edition/version,
+    in the same order as if every tag had been processed one at a time:
     {
       [registry...]: {
         [product...]: {
@@ -661,20 +647,43 @@ def analyze_images(registries: List[str],
     """
     logger.debug(
         f"Analyzing images for registries: {registries}, products: {products}, "
-        f"editions: {editions}, versions: {versions}")
+        f"editions: {editions}, versions: {versions}, jobs: {jobs}")
+
+    # One pool per registry, so a slow or rate-limited registry can't tie up
+    # the workers needed for the others
+    executors = {
+        registry: ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix=f"analyze-{registry}")
+        for registry in registries
+    }
 
     tags = defaultdict()
-    for product in products:
-        logger.debug(f"Processing product: {product}")
-        total_product_tags = 0
-        base_updates_available = 0
-
-        for edition in editions:
-            logger.debug(f"Processing edition: {edition}")
-            edition_results, tag_count, rebuild_count = process_product_edition(
-                registries, product, edition, versions)
+    try:
+        # Queue every tag of every product/edition before waiting on any
+        queued = []
+        for product in products:
+            for edition in editions:
+                logger.debug(f"Finding tags for {product} {edition}")
+                edition_results, work = product_edition_tags(
+                    registries, product, edition, versions)
+                futures = [
+                    (registry, semver, executors[registry].submit(
+                        process_single_tag,
+                        registry, product, edition, semver, tag))
+                    for registry, semver, tag in work
+                ]
+                queued.append((product, edition, edition_results, futures))
+
+        # Merge results in the order they were queued
+        product_counts = defaultdict(lambda: [0, 0])
+        for product, edition, edition_results, futures in queued:
+            for registry, semver, future in futures:
+                tag_data = future.result()
+                edition_results[registry][product][edition][semver] = tag_data
+                product_counts[product][0] += 1
+                if tag_data['rebuild_needed']:
+                    product_counts[product][1] += 1
 
-            # Merge results
             for registry in edition_results:
                 if registry not in tags:
                     tags[registry] = defaultdict()
@@ -685,10 +694,11 @@ def analyze_images(registries: List[str],
 
                     for ed in edition_results[registry][prod]:
                         tags[registry][prod][ed] = edition_results[registry][prod][ed]
+    finally:
+        for executor in executors.values():
+            executor.shutdown(cancel_futures=True)
 
-            total_product_tags += tag_count
-            base_updates_available += rebuild_count
-
+    for product, (total_product_tags, base_updates_available) in product_counts.items():
         if total_product_tags > 0:
             logger.info(
                 f"Processed {total_product_tags} tags for {product} ({base_updates_available} base image updates available)")
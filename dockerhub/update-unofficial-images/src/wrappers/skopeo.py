@@ -1,13 +1,19 @@
+import hashlib
 import json
 import logging
+import os
 import re
+import requests
 import shlex
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 from datetime import datetime, timezone
 from functools import lru_cache
 from time import sleep
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from src.wrappers.logging import setup_logging
 
@@ -35,6 +41,162 @@ class SkopeoCommandError(Exception):
     pass
 
 
+# On-disk cache of inspection results, keyed by manifest digest. A digest
+# identifies its content exactly, so entries never go stale - all that needs
+# checking on each run is which digest a tag currently points to.
+cache_dir = "cache/skopeo"
+
+# Manifest types we'll accept when asking a registry for a tag's digest - the
+# same ones skopeo asks for, so the registry answers with the same manifest
+# (and digest) that skopeo inspect would see
+MANIFEST_TYPES = [
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+]
+
+# Anonymous bearer tokens, keyed by (registry host, repository), with expiry
+# times, so later requests for the same repository can skip the challenge
+_tokens: Dict[Tuple[str, str], Tuple[str, float]] = {}
+_tokens_lock = threading.Lock()
+
+
+def _parse_reference(image: str) -> Tuple[str, str, str]:
+    """
+    Split an image reference (with or without docker:// prefix) into the
+    registry API host, repository path and tag or digest
+    """
+    ref = image.removeprefix("docker://")
+    if "@" in ref:
+        ref, reference = ref.split("@", 1)
+    else:
+        reference = "latest"
+        name, _, tag = ref.rpartition(":")
+        if name and "/" not in tag:
+            ref, reference = name, tag
+
+    host, _, path = ref.partition("/")
+    if not path or not ("." in host or ":" in host or host == "localhost"):
+        host, path = "docker.io", ref
+    if host == "docker.io":
+        host = "registry-1.docker.io"
+        if "/" not in path:
+            path = f"library/{path}"
+    return host, path, reference
+
+
+def _cached_token(host: str, path: str) -> Optional[str]:
+    with _tokens_lock:
+        token, expires = _tokens.get((host, path), (None, 0))
+    return token if expires > time.time() else None
+
+
+def _bearer_token(challenge: str, host: str, path: str) -> Optional[str]:
+    """
+    Get an anonymous token for a registry's WWW-Authenticate bearer challenge
+    """
+    params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+    if not challenge.lower().startswith("bearer") or "realm" not in params:
+        return None
+
+    response = requests.get(
+        params["realm"],
+        params={k: v for k, v in params.items() if k != "realm"},
+        timeout=10)
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    token = data.get("token") or data.get("access_token")
+    if token:
+        # Renew a little early so a token can't expire between use and check
+        expires = time.time() + max(data.get("expires_in", 60) - 15, 0)
+        with _tokens_lock:
+            _tokens[(host, path)] = (token, expires)
+    return token
+
+
+def _head_digest(image: str) -> Optional[str]:
+    """
+    Ask the registry for the digest a tag currently points to, with a single
+    HEAD request. Returns None if the registry won't say (e.g. because it
+    wants credentials only skopeo has), leaving the caller to fall back to
+    skopeo.
+    """
+    host, path, reference = _parse_reference(image)
+    if reference.startswith("sha256:"):
+        return reference
+
+    url = f"https://{host}/v2/{path}/manifests/{reference}"
+    headers = {"Accept": ", ".join(MANIFEST_TYPES)}
+    token = _cached_token(host, path)
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    try:
+        response = requests.head(url, headers=headers, timeout=10)
+        if response.status_code == 401:
+            token = _bearer_token(
+                response.headers.get("WWW-Authenticate", ""), host, path)
+            if token:
+                headers["Authorization"] = f"Bearer {token}"
+                response = requests.head(url, headers=headers, timeout=10)
+        if response.status_code == 200:
+            return response.headers.get("Docker-Content-Digest")
+        logger.debug(f"HEAD {url} returned {response.status_code}")
+    except requests.RequestException as e:
+        logger.debug(f"HEAD {url} failed: {e}")
+    return None
+
+
+@lru_cache(maxsize=None)
+def digest(image: str) -> str:
+    """
+    Get the digest an image reference currently points to (for multi-arch
+    images, the digest of the manifest list). Uses a HEAD request if the
+    registry allows it, else fetches the raw manifest with skopeo.
+    """
+    image_digest = _head_digest(image)
+    if image_digest:
+        logger.debug(f"Registry reports {image} is {image_digest}")
+        return image_digest
+
+    raw = _run_cmd(f"skopeo inspect --raw {image}")
+    image_digest = f"sha256:{hashlib.sha256(raw.encode()).hexdigest()}"
+    logger.debug(f"Raw manifest of {image} is {image_digest}")
+    return image_digest
+
+
+def _cache_path(image_digest: str) -> str:
+    return os.path.join(cache_dir, f"{image_digest.replace(':', '-')}.json")
+
+
+def _load_cached(image_digest: str) -> Optional[Dict]:
+    """
+    Get cached inspection results for a digest, if we have them
+    """
+    try:
+        with open(_cache_path(image_digest)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _save_cached(image_digest: str, entry: Dict) -> None:
+    """
+    Save inspection results for a digest. The file is written in full and
+    then renamed into place, so readers never see a partial entry.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, _cache_path(image_digest))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
 @lru_cache
 def _run_cmd(cmd: str, retries: int = 3) -> str:
     """
@@ -94,9 +256,21 @@ class Image():
         self.image = image
         # Get both amd64-specific and raw inspection results
         self.info, self.raw_info = self._inspect(f"{self.image}")
-        self.tags = sorted(self.info["RepoTags"])
+        self.digest = self.info.get("Digest")
         self.architectures = self._get_architectures()
-        logger.debug(f"Image initialized with {len(self.tags)} tags and architectures: {self.architectures}")
+        logger.debug(f"Image initialized with digest {self.digest} and architectures: {self.architectures}")
+
+    @property
+    def tags(self) -> List[str]:
+        """
+        All tags of the image's repository. Looked up on demand, as this
+        isn't part of what's cached for a digest.
+        """
+        repository = self.image.rsplit("@", 1)[0]
+        if ":" in repository.rsplit("/", 1)[-1]:
+            repository = repository.rsplit(":", 1)[0]
+        return sorted(json.loads(
+            _run_cmd(f"skopeo list-tags {repository}"))['Tags'])
 
     def create_date(self) -> int:
         """
@@ -110,9 +284,19 @@ class Image():
     def _inspect(self, image: str) -> Tuple[Dict, Dict]:
         """
         Inspect an image with Skopeo, returning both amd64-specific and raw inspection results
+
+        Results are cached on disk by digest, so an image which hasn't changed
+        since it was last inspected (by this or an earlier run) costs only the
+        request needed to find its current digest.
         """
         logger.debug(f"Inspecting image: {image}")
         try:
+            image_digest = digest(image)
+            cached = _load_cached(image_digest)
+            if cached is not None:
+                logger.debug(f"Using cached inspection of {image} ({image_digest})")
+                return cached["info"], cached["raw_info"]
+
             # Get amd64-specific info first
             amd64_result = json.loads(_run_cmd(f"skopeo inspect {image} --override-os linux --override-arch amd64"))
             logger.debug(f"AMD64-specific inspection complete for {image}")
@@ -121,6 +305,16 @@ class Image():
             raw_result = json.loads(_run_cmd(f"skopeo inspect --raw {image}"))
             logger.debug(f"Raw inspection complete for {image}")
 
+            # The tag list and name belong to the reference we asked about,
+            # not to the digest, so aren't kept. The entry is filed under
+            # the digest skopeo saw, in case the tag has moved since we
+            # looked it up.
+            amd64_result.pop("RepoTags", None)
+            amd64_result.pop("Name", None)
+            if amd64_result.get("Digest"):
+                _save_cached(amd64_result["Digest"],
+                             {"info": amd64_result, "raw_info": raw_result})
+
             return amd64_result, raw_result
         except (SystemExit, SkopeoCommandError):
             logger.error(f"Both inspection attempts failed for {image}")
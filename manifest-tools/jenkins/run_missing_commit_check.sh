@@ -15,6 +15,7 @@ show_help(){
     echo "  --show-matches                     Show matched commits as well as unmatched"
     echo "  --compare-builds                   Compare specific builds, not release trains"
     echo "  --no-sync                          Do not synchronise repositories (useful for debugging)"
+    echo "  --jobs <n>                         Number of manifest pairs to compare at once (default 1)"
     echo "  -h, --help                         Display this help and exit"
 }
 
@@ -23,7 +24,7 @@ if [ $# -eq 0 ]; then
     exit 0
 fi
 
-ARGS=$(getopt -o h -l help,product:,project:,first-manifest:,last-manifest:,test-email:,only-boundaries,show-matches,no-sync,notify,debug -- "$@")
+ARGS=$(getopt -o h -l help,product:,project:,first-manifest:,last-manifest:,test-email:,only-boundaries,show-matches,no-sync,notify,debug,jobs: -- "$@")
 
 if [ $? -ne 0 ]; then
     echo "Failed to parse arguments"
@@ -104,6 +105,10 @@ while true; do
             SYNC=false
             shift
             ;;
+        --jobs)
+            JOBS_ARG="--jobs $2"
+            shift 2
+            ;;
         --)
             shift
             break
@@ -242,6 +247,10 @@ PYTHONUNBUFFERED=1 find_missing_commits \
     $LAST_MANIFEST_ARG \
     $ONLY_BOUNDARIES_ARG \
     $COMPARE_BUILDS_ARG \
+    $JOBS_ARG \
+    --reuse_checkout \
+    --results ${reporef_dir}/.find_missing_commits/${PRODUCT}-results.jsonl \
+    --since_previous \
     --manifest_repo ${manifest_repo} \
     --reporef_dir ${reporef_dir} \
     --manifest_dir ${manifest_dir} \
@@ -0,0 +1,198 @@
+"""
+On-disk cache of the per-commit metadata find_missing_commits gathers -
+the added/removed lines of a commit's diff and the owner of the Gerrit
+change it was merged as - along with the Jira backport links of the
+tickets commits name.
+
+A commit never changes once it has a SHA, so anything worked out about it
+once holds for every later manifest pair, and every later nightly run.
+Entries are keyed by project and full SHA, and held in SQLite so the
+cache can be shared between runs without any locking of our own.
+"""
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+
+
+class CommitCache:
+    # Bump this when the shape of what's stored changes; a cache written
+    # by a different version is discarded rather than migrated
+    schema_version = 2
+
+    def __init__(self, logger, path):
+        """
+        Open (creating it if necessary) the cache database at path
+        """
+
+        self.log = logger
+        self.path = pathlib.Path(path)
+        self.lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self.db = self.open_db()
+        except sqlite3.DatabaseError as exc:
+            # Nothing in here can't be worked out again, so a damaged cache
+            # is no reason to fail the run
+            self.log.warning(f"Commit cache {self.path} is unusable, "
+                             f"starting a new one: {exc}")
+            # Along with any write-ahead log left beside it, which would
+            # otherwise be applied to the new database
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    pathlib.Path(f"{self.path}{suffix}").unlink()
+                except FileNotFoundError:
+                    pass
+            self.db = self.open_db()
+
+        self.hits = 0
+        self.misses = 0
+
+    def open_db(self):
+        """
+        Connect to the database and make sure the tables are present and
+        of the expected version
+        """
+
+        # Access from within this process goes through self.lock; parallel
+        # runs have other processes using the database too, and WAL lets
+        # them carry on reading while one of them writes
+        db = sqlite3.connect(str(self.path), check_same_thread=False,
+                             timeout=60)
+        db.execute("PRAGMA journal_mode=WAL")
+
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.schema_version:
+            if version:
+                self.log.info(f"Commit cache {self.path} is version "
+                              f"{version}, expected {self.schema_version}; "
+                              f"discarding it")
+            db.execute("DROP TABLE IF EXISTS commits")
+            db.execute("DROP TABLE IF EXISTS gerrit_owners")
+            db.execute("DROP TABLE IF EXISTS jira_backports")
+
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS commits (
+                project TEXT NOT NULL,
+                sha TEXT NOT NULL,
+                diff TEXT,
+                PRIMARY KEY (project, sha)
+            )""")
+        # Kept apart from the diffs as it's only looked up for
+        # commits which turn out to be missing.  A row with a NULL owner
+        # records that Gerrit was asked and had nobody to offer
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS gerrit_owners (
+                project TEXT NOT NULL,
+                sha TEXT NOT NULL,
+                owner TEXT,
+                PRIMARY KEY (project, sha)
+            )""")
+        # Unlike everything else here, a ticket's links can change, so
+        # they're only trusted for as long as the caller allows
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS jira_backports (
+                ticket TEXT PRIMARY KEY,
+                backports TEXT,
+                fetched REAL
+            )""")
+        db.execute(f"PRAGMA user_version = {self.schema_version}")
+        db.commit()
+
+        return db
+
+    def get_commit(self, project, sha):
+        """
+        Return the diff_changes of a commit, or None if we haven't seen it
+        before
+        """
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT diff FROM commits WHERE project = ? AND sha = ?",
+                (project, sha)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put_commits(self, project, commits):
+        """
+        Record the diffs of a batch of commits in a project, given as a dict
+        of sha -> diff_changes.  Each batch is committed straight away, as
+        parallel runs have other processes writing to the same database
+        """
+
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO commits VALUES (?, ?, ?)",
+                    [(project, sha, json.dumps(diff_changes))
+                     for sha, diff_changes in commits.items()])
+
+    def get_gerrit_owner(self, project, sha):
+        """
+        Return (True, owner) if the Gerrit owner of a commit has been looked
+        up before - owner may be None - or (False, None) if it hasn't
+        """
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT owner FROM gerrit_owners WHERE project = ? AND sha = ?",
+                (project, sha)).fetchone()
+
+        if row is None:
+            return (False, None)
+        return (True, row[0])
+
+    def put_gerrit_owner(self, project, sha, owner):
+        """
+        Record the outcome of a Gerrit owner lookup
+        """
+
+        with self.lock:
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO gerrit_owners VALUES (?, ?, ?)",
+                    (project, sha, owner))
+
+    def get_backports(self, tickets, max_age):
+        """
+        Return a dict of ticket -> list of tickets it is a backport of, for
+        those of tickets fetched from Jira less than max_age hours ago
+        """
+
+        oldest = time.time() - max_age * 3600
+        found = {}
+        with self.lock:
+            for ticket in tickets:
+                row = self.db.execute(
+                    "SELECT backports FROM jira_backports "
+                    "WHERE ticket = ? AND fetched >= ?",
+                    (ticket, oldest)).fetchone()
+                if row is not None:
+                    found[ticket] = json.loads(row[0])
+        return found
+
+    def put_backports(self, backports):
+        """
+        Record the backport links of a dict of tickets, as just fetched
+        """
+
+        now = time.time()
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO jira_backports VALUES (?, ?, ?)",
+                    [(ticket, json.dumps(links), now)
+                     for ticket, links in backports.items()])
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+        self.log.debug(f"Commit cache {self.path}: {self.hits} hits, "
+                       f"{self.misses} misses")
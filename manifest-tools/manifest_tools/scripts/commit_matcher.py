@@ -0,0 +1,129 @@
+"""
+Index of the commits found only in the target of a manifest comparison,
+used to look for an equivalent of each commit found only in the source.
+
+Commits are (sha, message, author, author_date, commit_date, diff_changes)
+tuples, as built by MissingCommits.commit_details().  Every lookup gives
+the same answer as comparing the commit against each indexed commit in
+turn and taking the first that matches, without doing so.
+"""
+import re
+
+from collections import Counter, defaultdict
+from thefuzz import fuzz
+
+
+# Pre-compiled regexes for backport substrings - we strip anything inside
+# [] as the format varies
+backport_regex = re.compile(r'\[.*?\][\s:]*')
+
+# After removing potential backport substrings, we strip out all non alpha
+# numeric characters to account for variances in punctuation, spaces etc.
+normalize_regex = re.compile(r'[^a-zA-Z0-9]')
+
+
+def normalize_summary(message):
+    """
+    Reduce a commit summary to the form summaries are compared in
+    """
+
+    return re.sub(backport_regex, '', re.sub(
+        normalize_regex, '', message)).lower()
+
+
+def diff_threshold(diff_changes):
+    """
+    Return the ratio a diff must exceed to be considered a match for
+    diff_changes - small diffs need to be closer to count
+    """
+
+    if len(diff_changes) <= 10:
+        return 90
+    elif len(diff_changes) <= 50:
+        return 80
+    return 70
+
+
+class CommitIndex:
+    def __init__(self, commits):
+        """
+        Index commits by normalized summary, by author and author date, and
+        by the lines of their diffs
+        """
+
+        self.commits = commits
+
+        # Only the first commit for each key is kept, as that's the one a
+        # linear search would have stopped at
+        self.summaries = {}
+        self.authored = {}
+
+        # Diff line -> [(commit index, number of times the line appears)]
+        self.diff_lines = defaultdict(list)
+        self.empty_diffs = []
+
+        for index, (_, message, author, author_date, _, diff_changes) \
+                in enumerate(commits):
+            if len(message) > 10:
+                self.summaries.setdefault(normalize_summary(message), index)
+            self.authored.setdefault((author, author_date), index)
+
+            if not diff_changes:
+                self.empty_diffs.append(index)
+            for line, count in Counter(diff_changes).items():
+                self.diff_lines[line].append((index, count))
+
+    def match_summary(self, commit):
+        """
+        Return the first indexed commit with the same summary, or None
+        """
+
+        index = self.summaries.get(normalize_summary(commit[1]))
+        return None if index is None else self.commits[index]
+
+    def match_date(self, commit):
+        """
+        Return the first indexed commit by the same author with the same
+        author date, or None
+        """
+
+        _, _, author, author_date, _, _ = commit
+        index = self.authored.get((author, author_date))
+        return None if index is None else self.commits[index]
+
+    def match_diff(self, commit):
+        """
+        Return (indexed commit, ratio) for the first indexed commit whose
+        diff is a close enough fuzzy match, or None
+        """
+
+        diff_changes = commit[5]
+        threshold = diff_threshold(diff_changes)
+
+        # Count the lines each indexed diff has in common with this one
+        shared = Counter()
+        for line, count in Counter(diff_changes).items():
+            for index, indexed_count in self.diff_lines.get(line, ()):
+                shared[index] += min(count, indexed_count)
+
+        candidates = set(shared)
+        if not diff_changes:
+            # Two empty diffs are a perfect match
+            candidates.update(self.empty_diffs)
+
+        for index in sorted(candidates):
+            indexed_diff = self.commits[index][5]
+            total = len(diff_changes) + len(indexed_diff)
+
+            # fuzz.ratio on two lists of lines is 200 * LCS / total, and the
+            # longest common subsequence can't be longer than the lines they
+            # share, so a diff which can't reach the threshold even then is
+            # passed over.  Anything within rounding of it is scored anyway
+            if total and 200 * shared[index] / total < threshold + 0.49:
+                continue
+
+            ratio = fuzz.ratio(diff_changes, indexed_diff)
+            if ratio > threshold:
+                return (self.commits[index], ratio)
+
+        return None
@@ -10,14 +10,14 @@ on their location in the manifest repository (e.g. released/4.6.1.xml).
 import argparse
 import concurrent.futures
 import contextlib
-import dulwich.patch
-import dulwich.porcelain
-import dulwich.repo
-import functools
+import copy
+import datetime
+import fcntl
+import hashlib
 import logging
+import multiprocessing
 import os
 import pathlib
-import io
 import json
 import re
 import shutil
@@ -29,14 +29,15 @@ import urllib.parse
 import urllib.request
 import xml.etree.ElementTree as ET
 
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from itertools import combinations
 from packaging.version import Version
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
-from thefuzz import fuzz
 from time import sleep
 
+from manifest_tools.scripts.commit_cache import CommitCache
+from manifest_tools.scripts.commit_matcher import CommitIndex
 from manifest_tools.scripts.jira_util import connect_jira, get_tickets
 
 
@@ -72,6 +73,15 @@ class MissingCommits:
     # Pre-compiled regex for short SHAs
     short_sha_regex = re.compile(r'[0-9a-f]{7,10}')
 
+    # Fields read from 'git log' for each commit, NUL separated
+    log_format = "%H%x00%h%x00%s%x00%ae%x00%ce%x00%ai%x00%ci"
+    log_fields = 7
+
+    # Starts each commit in a 'git log --patch' stream.  Every line of a
+    # diff starts with a space, '+', '-', '@', '\\' or a header word, so
+    # this can't be mistaken for one
+    patch_marker = "\x01"
+
     # Pre-compiled regex for tag reference
     tag_regex = re.compile(r'refs/tags/.*')
 
@@ -88,14 +98,6 @@ class MissingCommits:
         "asterixdb": "asterix-gerrit.ics.uci.edu",
     }
 
-    # Pre-compiled regexes for backport substrings - we strip anything inside
-    # [] as the format varies
-    backport_regex = re.compile(r'\[.*?\][\s:]*')
-
-    # After removing potential backport substrings, we strip out all non alpha
-    # numeric characters to account for variances in punctuation, spaces etc.
-    normalize_regex = re.compile(r'[^a-zA-Z0-9]')
-
     # Per-manifest options read from product-config.json.  A manifest which
     # is only in the list to have commits tracked into it - e.g. an
     # enterprise-analytics manifest listed under couchbase-server - wants all
@@ -105,6 +107,19 @@ class MissingCommits:
     fmc_skip_inherited = "find_missing_commits_skip_inherited"
     fmc_options = (fmc_force, fmc_target_only, fmc_skip_inherited)
 
+    # Pre-compiled regex for a Jira key mentioned in a commit subject
+    ticket_key_regex = re.compile(r'\b[A-Z][A-Z0-9]+-[0-9]+\b')
+
+    # Number of (project, revision) ticket indexes kept at any one time
+    ticket_index_limit = 32
+
+    # Bump this when the results store changes shape; a store written by a
+    # different version isn't reused
+    results_version = 1
+
+    # Maximum number of tickets fetched by a single JQL search
+    jira_batch_size = 100
+
     # Matched commits are categorised, the order here dictates the order they
     # will be shown in when running with DEBUG=true
     match_types = ["Backport", "Date match", "Diff match", "Summary match"]
@@ -120,7 +135,10 @@ class MissingCommits:
     def __init__(self, logger, product, manifest_dir, manifest_repo,
                  first_manifest, last_manifest, reporef_dir,
                  targeted_projects, debug, show_matches,
-                 only_boundaries, compare_builds, notify):
+                 only_boundaries, compare_builds, notify,
+                 commit_cache=None, record_commits=None,
+                 reuse_checkout=False, jira_cache_ttl=0, results=None,
+                 since_previous=False):
         """
         Store key information into instance attributes and determine
         path of 'repo' program
@@ -132,9 +150,13 @@ class MissingCommits:
         self.only_boundaries = only_boundaries
         self.compare_builds = compare_builds
         self.notify = notify
+        self.reuse_checkout = reuse_checkout
+
+        # Whether the checkout has been synced from the reference mirror
+        # during this run
+        self.checkout_fetched = False
 
         self.sha_lock = threading.Lock()
-        self.date_lock = threading.Lock()
         self.gerrit_lock = threading.Lock()
 
         # Used to attribute commits whose author isn't a Couchbase address.
@@ -162,11 +184,37 @@ class MissingCommits:
         self.last_manifest = last_manifest
 
         self.commits = default_dict_factory()
+
+        # Changes to self.commits waiting to be passed back to the parent,
+        # when running as a worker process of a parallel run
+        self.queued_changes = None
+
+        # With a results store, the changes each project comparison makes
+        # are kept, and with since_previous those from the last run are
+        # reused where nothing has changed
+        self.results_path = results
+        self.recorded_changes = None
+        self.project_results = {}
+        self.reused_projects = 0
+        self.previous_results = {}
+        if results is not None and since_previous:
+            self.previous_results = self.load_results(results)
         self.long_shas = {}
-        self.commit_authors_and_dates = {}
+        self.project_names = {}
+        self.project_remotes = {}
         self.commit_committers = {}
         self.gerrit_owners = {}
 
+        # Details of commits seen by earlier pairs and earlier runs, so each
+        # commit is only ever analyzed once
+        self.commit_cache = None
+        if commit_cache is not None:
+            self.commit_cache = CommitCache(self.log, commit_cache)
+
+        # When set, every set of commits compared is appended here, for
+        # replaying through the matcher with match_benchmark
+        self.record_commits = record_commits
+
         # Projects we don't care about
         self.ignore_projects = [
             'testrunner', 'libcouchbase', 'product-texts', 'product-metadata']
@@ -182,7 +230,13 @@ class MissingCommits:
         self.skipped_projects = []
 
         # We check jira and ignore tickets which are flagged "is a backport of"
-        # a ticket in the newer release
+        # a ticket in the newer release.  The links of every ticket looked
+        # at are kept for the rest of the run and, with a TTL, in the
+        # commit cache for later runs
+        self.backports = {}
+        self.ticket_indexes = OrderedDict()
+        self.jira_cache_ttl = jira_cache_ttl
+        self.jira_requests = 0
         try:
             self.log.debug("Connecting to Jira")
             self.jira = connect_jira()
@@ -343,13 +397,15 @@ class MissingCommits:
             stderr=stderr
         )
 
-    def check_output(self, cmd, cwd=None, stdin=None, stderr=None):
+    def check_output(self, cmd, cwd=None, stdin=None, stderr=None,
+                     input=None):
         self.log.debug(f"check_output: Running {' '.join([str(c) for c in cmd])} in {str(os.getcwd())} with cwd {str(cwd)}")
         return subprocess.check_output(
             cmd,
             cwd=cwd,
             stdin=stdin,
-            stderr=stderr
+            stderr=stderr,
+            input=input
         )
 
     def Popen(self, cmd, cwd=os.getcwd(), stdin=None, stdout=None, stderr=None):
@@ -578,6 +634,41 @@ class MissingCommits:
 
         return url.replace("ssh://git@", "https://")
 
+    def ticket_index(self, repo_path, revision):
+        """
+        Return a dict of each Jira key mentioned in the history of revision
+        in a project to the (position, sha, subject) of the commits which
+        mention it, position counting back from revision.  Built from a
+        single walk of the history, and kept for reuse by later commits
+        and pairs with the same target
+        """
+
+        key = (repo_path, revision)
+        if key in self.ticket_indexes:
+            self.ticket_indexes.move_to_end(key)
+            return self.ticket_indexes[key]
+
+        index = defaultdict(list)
+        proc = self.Popen(
+            [self.git_bin, 'log', '--format=%h %s', revision],
+            cwd=self.product_dir / repo_path, stdout=subprocess.PIPE)
+        for position, raw_line in enumerate(proc.stdout):
+            sha, _, subject = raw_line.decode(
+                errors='replace').rstrip('\n').partition(' ')
+            for ticket in set(self.ticket_key_regex.findall(subject)):
+                index[ticket].append((position, sha, subject))
+        if proc.wait() != 0:
+            raise RuntimeError(f'The "git log" command for project '
+                               f'"{repo_path}" failed')
+
+        # A project's whole history can be a lot of commits, so only keep
+        # the indexes used most recently
+        self.ticket_indexes[key] = index
+        if len(self.ticket_indexes) > self.ticket_index_limit:
+            self.ticket_indexes.popitem(last=False)
+
+        return index
+
     def get_jira_ticket(self, ticket):
         """
         Fetch and return a specified jira ticket
@@ -610,6 +701,8 @@ class MissingCommits:
         self.repo_sync()
         manifest_diff = self.diff_manifests()
         self.ignored_commits = self.get_ignored_commits()
+        self.ignored_digest = hashlib.sha256(
+            "\n".join(sorted(self.ignored_commits)).encode()).hexdigest()
 
         changes = dict()
         # Create dictionary with all the relevant changes; this avoids
@@ -646,7 +739,7 @@ class MissingCommits:
             try:
                 if change_info[0] == 'changed':
                     change_info = change_info[1:]
-                    self.show_needed_commits(repo_path, change_info)
+                    self.compare_project(repo_path, change_info)
                 elif change_info[0] == 'added':
                     _, new_commit, new_diff = change_info
                     for pre in self.merge_map[repo_path]:
@@ -663,6 +756,199 @@ class MissingCommits:
                 self.skipped_projects.append(
                     (self.old_manifest, self.new_manifest, repo_path, exc))
 
+    def compare_project(self, repo_path, change_info):
+        """
+        Run show_needed_commits() for a project, noting the changes it makes
+        to the results so they can be written to the results store.  If
+        the previous run's store shows the same comparison of the same
+        revisions, with the same ignored commits, its changes are replayed
+        instead - unless it found commits missing, which are always looked
+        at again in case Jira has turned them into backports since
+        """
+
+        if self.results_path is None:
+            self.show_needed_commits(repo_path, change_info)
+            return
+
+        source_sha, target_sha = change_info
+        shas = self.resolve_shas(repo_path, [source_sha, target_sha])
+        key = (self.old_manifest, self.new_manifest, repo_path,
+               shas[source_sha], shas[target_sha], self.ignored_digest)
+
+        previous = self.previous_results.get(key)
+        self.recorded_changes = []
+        try:
+            if previous is not None and not any(
+                    method == "_apply_missing" for method, _ in previous):
+                self.log.debug(f"{repo_path} is unchanged since the previous "
+                               f"run, reusing its results")
+                self.reused_projects += 1
+                for method, args in previous:
+                    self.record_change(method, *args)
+            else:
+                self.show_needed_commits(repo_path, change_info)
+            self.project_results[key] = self.recorded_changes
+        finally:
+            self.recorded_changes = None
+
+    def load_results(self, path):
+        """
+        Read the per-project changes from a results store written by
+        write_results(), keyed as in compare_project()
+        """
+
+        previous = {}
+        try:
+            with open(path) as fh:
+                for line in fh:
+                    entry = json.loads(line)
+                    if entry["type"] == "run" and (
+                            entry["version"] != self.results_version
+                            or entry["product"] != self.product):
+                        self.log.info(f"{path} is from a different product "
+                                      f"or version, not reusing it")
+                        return {}
+                    if entry["type"] == "project":
+                        previous[tuple(entry["key"])] = [
+                            (method, args) for method, args in entry["changes"]
+                        ]
+        except FileNotFoundError:
+            self.log.info(f"No previous results in {path}, comparing "
+                          f"everything")
+        except (ValueError, KeyError) as exc:
+            self.log.warning(f"Unable to read previous results from {path}, "
+                             f"comparing everything: {exc}")
+            return {}
+
+        self.log.info(f"Read previous results for {len(previous)} project "
+                      f"comparisons from {path}")
+        return previous
+
+    def write_results(self, failed_comparisons):
+        """
+        Write the results store: a JSON Lines file with a 'run' entry, a
+        'commit' entry for every tracked or matched commit, and a 'project'
+        entry holding the changes each project comparison made, for
+        --since_previous to reuse
+        """
+
+        entries = [{
+            "type": "run",
+            "version": self.results_version,
+            "product": self.product,
+            "generated": datetime.datetime.now(
+                datetime.timezone.utc).isoformat(),
+            "manifests": self.manifests,
+            "total_missing": self.total_missing,
+            "matched_commits": self.matched_commits,
+            "failed_comparisons": [[a, b, str(exc)]
+                                   for a, b, exc in failed_comparisons],
+            "skipped_projects": [[a, b, repo_path, str(exc)]
+                                 for a, b, repo_path, exc
+                                 in self.skipped_projects],
+        }]
+
+        for project, info in self.commits[self.product].items():
+            for sha, details in info.get("TrackedCommits", {}).items():
+                entries.append({
+                    "type": "commit",
+                    "project": project,
+                    "url": info.get("url"),
+                    "sha": sha,
+                    "status": "missing" if details["missing_from"] else "present",
+                    **details,
+                })
+            for match_type in self.match_types:
+                for sha, details in info.get(match_type, {}).items():
+                    entries.append({
+                        "type": "commit",
+                        "project": project,
+                        "url": info.get("url"),
+                        "sha": sha,
+                        "status": match_type,
+                        "missing_from": [],
+                        **details,
+                    })
+
+        for key, changes in self.project_results.items():
+            entries.append({
+                "type": "project",
+                "key": list(key),
+                "changes": changes,
+            })
+
+        # Write alongside and rename into place, so a run which dies part
+        # way through doesn't leave the next one nothing to go on
+        pathlib.Path(self.results_path).parent.mkdir(parents=True,
+                                                     exist_ok=True)
+        tmp_path = f"{self.results_path}.tmp"
+        with open(tmp_path, "w") as fh:
+            for entry in entries:
+                fh.write(json.dumps(entry) + os.linesep)
+        os.replace(tmp_path, self.results_path)
+
+        self.log.info(f"Wrote results to {self.results_path}, reused "
+                      f"{self.reused_projects} project comparisons")
+
+    @staticmethod
+    def backport_links(jira_ticket):
+        """
+        Return the keys of the tickets a Jira ticket is flagged "is a
+        backport of"
+        """
+
+        backports = []
+        for issuelink in jira_ticket.raw["fields"].get("issuelinks", []):
+            if issuelink["type"]["outward"] == "is a backport of":
+                # Ensure we're looking at the actual backport ticket,
+                # not a ticket that was itself backported
+                if "outwardIssue" in issuelink:
+                    backports.append(issuelink["outwardIssue"]["key"])
+        return backports
+
+    def prefetch_backports(self, tickets):
+        """
+        Make sure the backport links of a collection of tickets are cached,
+        reading what we can from the on-disk cache and fetching the rest
+        with one JQL search per batch_size tickets.  Anything a search
+        doesn't turn up - e.g. a ticket which has since moved project - is
+        left for backports_of() to fetch on its own
+        """
+
+        wanted = sorted(set(tickets) - set(self.backports))
+        if not wanted:
+            return
+
+        if self.commit_cache is not None and self.jira_cache_ttl:
+            cached = self.commit_cache.get_backports(
+                wanted, self.jira_cache_ttl)
+            self.backports.update(cached)
+            wanted = [ticket for ticket in wanted if ticket not in cached]
+
+        fetched = {}
+        for start in range(0, len(wanted), self.jira_batch_size):
+            batch = wanted[start:start + self.jira_batch_size]
+            try:
+                self.log.debug(f"Fetching {len(batch)} Jira tickets")
+                self.jira_requests += 1
+                # Without query validation, Jira skips keys which don't
+                # exist rather than failing the whole search
+                issues = self.jira.search_issues(
+                    f"key in ({', '.join(batch)})", maxResults=len(batch),
+                    validate_query=False, fields="issuelinks")
+            except Exception as exc:
+                self.log.warning(f"Jira search for {len(batch)} tickets "
+                                 f"failed, they will be fetched one at a "
+                                 f"time: {exc}")
+                continue
+            for issue in issues:
+                if issue.key in batch:
+                    fetched[issue.key] = self.backport_links(issue)
+
+        self.backports.update(fetched)
+        if fetched and self.commit_cache is not None and self.jira_cache_ttl:
+            self.commit_cache.put_backports(fetched)
+
     def backports_of(self, tickets, retries=3):
         """
         For a list of tickets, gather any outward links flagged "is a
@@ -670,47 +956,53 @@ class MissingCommits:
         references
         """
 
+        tickets = list(tickets)
+        self.prefetch_backports(tickets)
+
         backports = []
         for ticket in tickets:
-            for _ in range(retries):
-                try:
-                    jira_ticket = self.get_jira_ticket(ticket)
-                    # Connection failures don't seem to raise an error, so we just
-                    # check if jira_ticket came back ok and retry 3 times if not
-                    # before giving up
-                    if not jira_ticket:
-                        sleep(1)
-                        return self.backports_of(tickets, retries-1)
-                    for issuelink in jira_ticket.raw["fields"]["issuelinks"]:
-                        if issuelink["type"]["outward"] == "is a backport of":
-                            # Ensure we're looking at the actual backport ticket,
-                            # not a ticket that was itself backported
-                            if "outwardIssue" in issuelink:
-                                backports.append(
-                                    issuelink["outwardIssue"]["key"])
-                    # If we got here we can break out of the retry loop and
-                    # move on to the next ticket
-                    break
-                except Exception as exc:
+            if ticket not in self.backports:
+                for _ in range(retries):
+                    try:
+                        self.jira_requests += 1
+                        jira_ticket = self.get_jira_ticket(ticket)
+                        # Connection failures don't seem to raise an error,
+                        # so we just check if jira_ticket came back ok and
+                        # retry if not
+                        if not jira_ticket:
+                            sleep(1)
+                            continue
+                        self.backports[ticket] = \
+                            self.backport_links(jira_ticket)
+                        if (self.commit_cache is not None
+                                and self.jira_cache_ttl):
+                            self.commit_cache.put_backports(
+                                {ticket: self.backports[ticket]})
+                        # If we got here we can break out of the retry loop
+                        # and move on to the next ticket
+                        break
+                    except Exception:
+                        self.log.error(
+                            f"Jira ticket retrieval failed for {ticket}")
+                else:
+                    # If we got here, we ran out of retries without hitting
+                    # the break.  Most likely the ticket doesn't exist, so
+                    # don't ask again for every commit naming it this run -
+                    # but don't keep that beyond the run either
                     self.log.error(
                         f"Jira ticket retrieval failed for {ticket}")
-            else:
-                # If we got here, we ran out of retries without hitting the
-                # break
-                self.log.error(f"Jira ticket retrieval failed for {ticket}")
+                    self.backports[ticket] = []
+
+            backports.extend(self.backports[ticket])
 
         return backports
 
-    def repo_sync(self):
+    def clean_product_dir(self):
         """
-        Initialize and sync a repo checkout based on the target
-        manifest; generate a new manifest with fixed SHAs in case
-        the target contains branches (e.g. master) via the command
-        'repo manifest -r' so 'git log' will work properly
+        Remove any previous checkout and create an empty 'product' directory
+        to contain a new one
         """
 
-        self.repo_bin = shutil.which('repo')
-        # Create a 'product' directory to contain the repo checkout
         if self.product_dir.exists():
             self.log.debug(f'"{self.product_dir}" exists, removing...')
             try:
@@ -722,10 +1014,20 @@ class MissingCommits:
                 traceback.print_exc()
                 raise RuntimeError(
                     f'Unable to delete "{self.product_dir}" file/link: '
-                    f'{exc.message}'
+                    f'{exc}'
                 ) from exc
         self.product_dir.mkdir(parents=True, exist_ok=True)
 
+    def repo_init_and_sync(self, local_only):
+        """
+        Point the checkout in the 'product' directory at the target
+        manifest and sync it.  With local_only, the sync only checks out
+        what has already been fetched, falling back to fetching if that
+        isn't enough - e.g. the manifest has a project no earlier one did
+        """
+
+        self.repo_bin = shutil.which('repo')
+
         try:
             cmd = [self.repo_bin, 'init', '-u',
                    self.manifest_dir,
@@ -749,6 +1051,17 @@ class MissingCommits:
         # cwd=self.product_dir, so this relative path will work.
         self.repo_bin = os.path.join(".repo", "repo", "repo")
 
+        if local_only:
+            try:
+                self.check_output(
+                    [self.repo_bin, 'sync', '--jobs=8', '--local-only'],
+                    cwd=self.product_dir, stderr=subprocess.STDOUT
+                )
+                return
+            except subprocess.CalledProcessError as exc:
+                self.log.info(f'Local-only "repo sync" for {self.new_manifest} '
+                              f'failed, fetching: {exc.output}')
+
         try:
             cmd = [self.repo_bin, 'sync',
                     f'--jobs=8', '--force-sync']
@@ -761,6 +1074,38 @@ class MissingCommits:
             raise RuntimeError(
                 f'The "repo sync" command failed: {exc.output}') from exc
 
+    def repo_sync(self):
+        """
+        Initialize and sync a repo checkout based on the target
+        manifest; generate a new manifest with fixed SHAs in case
+        the target contains branches (e.g. master) via the command
+        'repo manifest -r' so 'git log' will work properly
+
+        With reuse_checkout, the checkout left by the previous manifest
+        pair - or the previous run - is re-pointed at the target manifest
+        instead of being replaced.  Its first sync in a run fetches, to
+        pick up anything new in the reference mirror; every sync after
+        that only needs to check out what's already there
+        """
+
+        reusable = (self.reuse_checkout
+                    and (self.product_dir / ".repo").is_dir())
+
+        if reusable:
+            try:
+                self.repo_init_and_sync(local_only=self.checkout_fetched)
+            except RuntimeError as exc:
+                self.log.warning(f'Unable to reuse the checkout in '
+                                 f'"{self.product_dir}", starting afresh: '
+                                 f'{exc}')
+                reusable = False
+
+        if not reusable:
+            self.clean_product_dir()
+            self.repo_init_and_sync(local_only=False)
+
+        self.checkout_fetched = True
+
         # This is needed for manifests with projects not locked down
         # (e.g. spock.xml)
         try:
@@ -774,6 +1119,8 @@ class MissingCommits:
             raise RuntimeError(
                 f'The "repo manifest -r" command failed: {exc.output}') from exc
 
+        self.load_resolved_manifest()
+
         # Patch last - 'repo sync' can update .repo/repo, which would undo
         # anything we'd applied before it
         self.fix_diffmanifests_cmd()
@@ -816,32 +1163,6 @@ class MissingCommits:
 
         return project_lines
 
-    def get_author_and_dates(self, repo_path, commit_sha):
-        """
-        Get the author date for a specific SHA
-        """
-
-        with self.date_lock:
-            if commit_sha in self.commit_authors_and_dates:
-                return self.commit_authors_and_dates[commit_sha]
-
-        project_dir = self.product_dir / repo_path
-        try:
-            # The committer comes along for free here, and is needed when the
-            # author turns out not to be a Couchbase address
-            (author, committer, author_date, commit_date) = self.check_output(
-                ['git', 'show', '-s', '--format=%ae|%ce|%ai|%ci', commit_sha],
-                cwd=project_dir
-            ).decode().strip().split("|")
-            self.commit_authors_and_dates[commit_sha] = (author, author_date, commit_date)
-            self.commit_committers[commit_sha] = committer
-            return (author, author_date, commit_date)
-        except subprocess.CalledProcessError as exc:
-            traceback.print_exc()
-            raise RuntimeError(
-                f'Failed to retrieve author and commit dates for '
-                f'{commit_sha}: {exc.output}') from exc
-
     @staticmethod
     def is_couchbase_email(email):
         return bool(email) and email.endswith("@couchbase.com")
@@ -871,7 +1192,16 @@ class MissingCommits:
             if commit_sha in self.gerrit_owners:
                 return self.gerrit_owners[commit_sha]
 
+        if self.commit_cache is not None:
+            known, owner = self.commit_cache.get_gerrit_owner(
+                repo_path, commit_sha)
+            if known:
+                with self.gerrit_lock:
+                    self.gerrit_owners[commit_sha] = owner
+                return owner
+
         owner = None
+        resolved = False
         try:
             message = self.check_output(
                 ['git', 'show', '-s', '--format=%B', commit_sha],
@@ -901,6 +1231,7 @@ class MissingCommits:
                     self.log.debug(
                         f'{host} has no visible change '
                         f'{change_id.group(1)} for {commit_sha[:7]}')
+            resolved = True
         except (subprocess.CalledProcessError, json.JSONDecodeError,
                 OSError, ValueError) as exc:
             # Warn once per host rather than per commit - a Gerrit we can't
@@ -917,6 +1248,10 @@ class MissingCommits:
 
         with self.gerrit_lock:
             self.gerrit_owners[commit_sha] = owner
+        # Only remember an answer Gerrit actually gave us - one we couldn't
+        # reach should be asked again next time
+        if resolved and self.commit_cache is not None:
+            self.commit_cache.put_gerrit_owner(repo_path, commit_sha, owner)
         return owner
 
     def notify_email(self, repo_path, commit_sha, author):
@@ -955,55 +1290,112 @@ class MissingCommits:
 
         return author
 
-    def get_commit_details(self, line, repo_path):
-        """
-        Retrieves the commit details for a given line of git output
-        (a sha followed by the subject line of that sha)
-        """
-        sha, msg = line.split(' ', 1)
-        long_sha = self.get_long_sha(repo_path, sha)
-        author, author_date, commit_date = self.get_author_and_dates(repo_path, long_sha)
-        diff_changes = self.get_diff_changes(repo_path, long_sha)
-        return (sha, msg, author, author_date, commit_date, diff_changes)
-
-    def get_diff_changes(self, repo_path, commit_sha):
+    def log_commits(self, repo_path, rev_range):
         """
-        Retrieve a diff for a given sha showing only added/removed lines
+        Run a single 'git log' over a symmetric difference, keeping only the
+        right-hand side's commits which have no equivalent on the left, and
+        return (long_sha, short_sha, subject, author, committer, author_date,
+        commit_date) for each of them
         """
 
-        project_dir = self.product_dir / repo_path
-        repo = dulwich.repo.Repo(str(project_dir.resolve()))
+        try:
+            output = self.check_output(
+                [self.git_bin, 'log', '-z', f'--format={self.log_format}',
+                 '--cherry-pick', '--right-only', '--no-merges', rev_range],
+                cwd=self.product_dir / repo_path, stderr=subprocess.PIPE
+            ).decode(errors='replace')
+        except subprocess.CalledProcessError as exc:
+            traceback.print_exc()
+            raise RuntimeError(f'The "git log" command for project "{repo_path}" '
+                               f'failed: {exc.stderr}') from exc
 
-        # Make sure we're working with the full sha, or the lookup below
-        # will throw an error
-        commit_sha = self.get_long_sha(repo_path, commit_sha)
+        # With -z every field and every commit ends in a NUL, so the fields
+        # of each commit are simply the next log_fields entries
+        fields = output.split('\0')[:-1]
+        if len(fields) % self.log_fields:
+            raise RuntimeError(f'Unexpected "git log" output for project '
+                               f'"{repo_path}" over {rev_range}')
 
-        obj = repo[bytes(commit_sha, 'utf-8')]
+        return [
+            tuple(fields[i:i + self.log_fields])
+            for i in range(0, len(fields), self.log_fields)
+        ]
 
-        if isinstance(obj, dulwich.objects.Tag):
-            commit = repo[obj.object[1]]
-        else:
-            commit = obj
+    def log_diffs(self, repo_path, commit_shas):
+        """
+        Retrieve the diffs of a list of commits, showing only added/removed
+        lines, from a single 'git log --patch' stream
+        """
 
-        if not isinstance(commit, dulwich.objects.Commit):
-            self.log.error(
-                f'The object resolved from SHA {commit_sha} in {repo_path} is '
-                'not a commit.')
-            return []
+        diffs = {sha: [] for sha in commit_shas}
+        if not diffs:
+            return diffs
+
+        # Merges are never asked for, so each diff is against the commit's
+        # only parent
+        proc = self.Popen(
+            [self.git_bin, 'log', '--no-walk=unsorted', '--stdin', '--patch',
+             '--no-color', '--no-ext-diff', '--no-renames',
+             f'--format={self.patch_marker}%H'],
+            cwd=self.product_dir / repo_path,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        # git reads every revision from stdin before it starts walking, so
+        # there's no need to interleave writing these with reading output
+        proc.stdin.write(''.join(f'{sha}\n' for sha in diffs).encode())
+        proc.stdin.close()
+
+        current = None
+        for raw_line in proc.stdout:
+            line = raw_line.decode(errors='replace').rstrip('\n')
+            if line.startswith(self.patch_marker):
+                current = diffs.get(line[len(self.patch_marker):])
+            elif current is not None and line.startswith(('+', '-')):
+                current.append(line)
+
+        if proc.wait() != 0:
+            raise RuntimeError(f'The "git log --patch" command for project '
+                               f'"{repo_path}" failed')
+
+        return diffs
+
+    def commit_details(self, repo_path, logged_commits, with_diffs):
+        """
+        Turn the output of log_commits() into the (sha, message, author,
+        author_date, commit_date, diff_changes) tuples the match_* methods
+        use.  Diffs are taken from the commit cache where possible, and all
+        the rest fetched in one go; without with_diffs every diff is left
+        empty
+        """
 
-        if not commit.parents:
-            self.log.error(f"No parents on {commit_sha} in {repo_path}")
-            return []
+        diffs = {}
+        uncached = []
+        for long_sha, short_sha, _, _, committer, _, _ in logged_commits:
+            with self.sha_lock:
+                self.long_shas[f"{repo_path}:{short_sha}"] = long_sha
+            self.commit_committers[long_sha] = committer
 
-        prev_commit = repo[commit.parents[0]]
+            if not with_diffs:
+                continue
+            cached = None
+            if self.commit_cache is not None:
+                cached = self.commit_cache.get_commit(repo_path, long_sha)
+            if cached is not None:
+                diffs[long_sha] = cached
+            else:
+                uncached.append(long_sha)
 
-        fh = io.BytesIO()
-        dulwich.patch.write_tree_diff(fh, repo.object_store, prev_commit.tree,
-                                      commit.tree)
+        if uncached:
+            fetched = self.log_diffs(repo_path, uncached)
+            diffs.update(fetched)
+            if self.commit_cache is not None:
+                self.commit_cache.put_commits(repo_path, fetched)
 
         return [
-            line for line in fh.getvalue().decode(errors='replace').split('\n')
-            if line and line.startswith(('+', '-'))
+            (short_sha, message, author, author_date, commit_date,
+             diffs.get(long_sha, []))
+            for (long_sha, short_sha, message, author, _, author_date,
+                 commit_date) in logged_commits
         ]
 
     def get_long_sha(self, project, commit):
@@ -1011,47 +1403,100 @@ class MissingCommits:
         Find the full SHA from a specified branch/tag/SHA
         """
 
-        # In cache? Just return it
+        return self.resolve_shas(project, [commit])[commit]
+
+    def resolve_shas(self, project, commits):
+        """
+        Find the full SHAs for a list of branches/tags/SHAs in a project,
+        returning a dict of each entry to its SHA.  Anything not already
+        known is resolved in a single 'git cat-file --batch-check' run in
+        the project's checkout, rather than a 'repo forall' per entry
+        """
+
+        resolved = {}
+        queries = {}
+
         with self.sha_lock:
-            if f"{project}:{commit[:7]}" in self.long_shas:
-                return self.long_shas[f"{project}:{commit[:7]}"]
-
-        # Long sha? cache and return
-        if MissingCommits.long_sha_regex.fullmatch(commit) is not None:
-            self.long_shas[f"{project}:{commit[:7]}"] = commit
-            return commit
-
-        # Not a long SHA, so ask git to turn it into one. If 'commit'
-        # looks like a short sha, use rev-parse, if it looks like a tag
-        # reference, use it directly with show-ref; otherwise, assume it's
-        # a branch name, prepend the remote name to disambiguate and use
-        # show-ref
-        if MissingCommits.short_sha_regex.fullmatch(commit) is not None:
-            cmd = "git rev-parse"
-            git_ref = commit
-        elif MissingCommits.tag_regex.fullmatch(commit) is not None:
-            cmd = "git show-ref --hash"
-            git_ref = commit
-        else:
-            # $REPO_REMOTE is set by 'repo forall'
-            cmd = "git show-ref --hash"
-            git_ref = f'$REPO_REMOTE/{commit}'
+            for commit in commits:
+                key = f"{project}:{commit}"
+                if key in self.long_shas:
+                    resolved[commit] = self.long_shas[key]
+                elif MissingCommits.long_sha_regex.fullmatch(commit) is not None:
+                    self.long_shas[key] = commit
+                    resolved[commit] = commit
+                elif (MissingCommits.short_sha_regex.fullmatch(commit) is not None
+                        or MissingCommits.tag_regex.fullmatch(commit) is not None):
+                    # Short SHAs and tag references can be looked up as-is
+                    queries[commit] = commit
+                else:
+                    # Assume anything else is a branch name, and look for it
+                    # on the project's remote to disambiguate
+                    remote = self.project_remotes.get(project)
+                    if remote is None:
+                        raise RuntimeError(
+                            f'Unable to resolve {commit} in {project}, the '
+                            f'project has no remote in the synced manifest')
+                    queries[commit] = f'refs/remotes/{remote}/{commit}'
+
+        if not queries:
+            return resolved
 
         try:
-            commit_sha = self.check_output(
-                [self.repo_bin, 'forall', project, '-c',
-                 f'{cmd} {git_ref}'],
-                cwd=self.product_dir, stderr=subprocess.STDOUT
-            ).decode().strip()
+            output = self.check_output(
+                [self.git_bin, 'cat-file', '--batch-check=%(objectname)'],
+                cwd=self.product_dir / project,
+                input='\n'.join(queries.values()).encode() + b'\n',
+                stderr=subprocess.STDOUT
+            ).decode().splitlines()
         except subprocess.CalledProcessError as exc:
             traceback.print_exc()
             raise RuntimeError(
-                f'The "repo forall" command failed: {exc.output}') from exc
+                f'The "git cat-file" command failed: {exc.output}') from exc
+
+        # cat-file answers each query on its own line, in order, with either
+        # the object name or the query followed by "missing"/"ambiguous"
+        unresolved = []
+        with self.sha_lock:
+            for commit, line in zip(queries, output):
+                if MissingCommits.long_sha_regex.fullmatch(line) is None:
+                    unresolved.append(line)
+                    continue
+                self.long_shas[f"{project}:{commit}"] = line
+                resolved[commit] = line
+
+        if unresolved or len(output) != len(queries):
+            raise RuntimeError(
+                f'Unable to resolve revisions in {project}: '
+                f'{", ".join(unresolved) or "no output from git cat-file"}')
+
+        return resolved
+
+    def load_resolved_manifest(self):
+        """
+        Read the path, name and remote of every project from the manifest
+        'repo manifest -r' produced during the sync, so they can be looked
+        up without asking repo
+        """
 
-        self.long_shas[f"{project}:{commit[:7]}"] = commit_sha
-        return commit_sha
+        root = ET.parse(pathlib.Path('new.xml').resolve()).getroot()
+
+        default_remote = None
+        default = root.find("default")
+        if default is not None:
+            default_remote = default.get("remote")
+
+        self.project_names = {}
+        self.project_remotes = {}
+        for project in root.findall("project"):
+            name = project.get("name")
+            path = project.get("path") or name
+            self.project_names[path] = name
+            self.project_remotes[path] = project.get("remote") or default_remote
 
     def get_project_name(self, project_dir):
+        if project_dir in self.project_names:
+            return self.project_names[project_dir]
+
         project_name = self.check_output(
             [self.repo_bin, 'forall', project_dir, '-c',
                 f'echo $REPO_PROJECT'],
@@ -1077,10 +1522,40 @@ class MissingCommits:
                 if manifest not in status["present_in"] and manifest not in status["missing_from"]:
                     status["missing_from"].append(manifest)
 
+    def record_change(self, method, *args):
+        """
+        Make a change to the results in self.commits by calling method with
+        args.  In a worker process of a parallel run the change is queued
+        instead, for the parent to make once the results of every earlier
+        pair are in, so the outcome is the same as a serial run's
+        """
+
+        if self.recorded_changes is not None:
+            self.recorded_changes.append((method, args))
+
+        if self.queued_changes is None:
+            getattr(self, method)(*args)
+        else:
+            self.queued_changes.append((method, args))
+
+    def apply_changes(self, changes):
+        """
+        Make the changes queued by a worker process
+        """
+
+        for method, args in changes:
+            getattr(self, method)(*args)
+
     def add_match(self, match_type, project, author, old_sha, old_commit_message, new_sha, new_commit_message, extra_info=None):
+        self.record_change(
+            "_apply_match", [self.old_manifest, self.new_manifest],
+            match_type, project, author, old_sha, old_commit_message,
+            new_sha, new_commit_message, extra_info)
+
+    def _apply_match(self, manifests, match_type, project, author, old_sha, old_commit_message, new_sha, new_commit_message, extra_info=None):
         if new_sha not in self.commits[self.product][project][match_type]:
             self.commits[self.product][project][match_type][new_sha] = {
-                "present_in": [self.old_manifest, self.new_manifest],
+                "present_in": list(manifests),
                 "message": new_commit_message,
                 "author": author,
                 "matched": {
@@ -1089,7 +1564,7 @@ class MissingCommits:
                 **(extra_info or {})
             }
         else:
-            for manifest in [self.old_manifest, self.new_manifest]:
+            for manifest in manifests:
                 if manifest not in self.commits[self.product][project][match_type][new_sha]["present_in"]:
                     self.commits[
                         self.product][project][match_type][new_sha]["present_in"].append(manifest)
@@ -1098,56 +1573,80 @@ class MissingCommits:
         # that it is present in both manifests (e.g., via a backport or fuzzy match).
         tracked = self.commits[self.product][project].get("TrackedCommits", {})
         if new_sha in tracked:
-            self._mark_commit_status(project, new_sha, present_in=[self.old_manifest, self.new_manifest])
+            self._mark_commit_status(project, new_sha, present_in=manifests)
+
+        self.matched_commits += 1
+
+    def _apply_project(self, project, url):
+        if project not in self.commits[self.product]:
+            self.commits[self.product][project] = default_dict_factory()
+            self.commits[self.product][project]["url"] = url
+
+    def is_tracked(self, project, sha):
+        """
+        Whether a commit is already among the tracked (possibly missing)
+        commits of a project, without creating entries for either
+        """
+
+        return sha in self.commits[self.product].get(
+            project, {}).get("TrackedCommits", {})
 
+    def _apply_present(self, project, sha, manifest):
+        if sha in self.commits[self.product][project]["TrackedCommits"]:
+            self._mark_commit_status(project, sha, present_in=[manifest])
+
+    def _apply_missing(self, project, sha, details, old_manifest, new_manifest):
+        if sha not in self.commits[self.product][project]["TrackedCommits"]:
+            # A copy, so the change itself stays as recorded
+            self.commits[self.product][project]["TrackedCommits"][sha] = \
+                copy.deepcopy(details)
+
+        self._mark_commit_status(project, sha,
+                                 present_in=[old_manifest],
+                                 missing_from=[new_manifest])
+
+    def _apply_backport(self):
+        # A backport is counted once here and again by its add_match()
         self.matched_commits += 1
 
     def match_date(self, project, new_commit, old_commits):
         """
         Checks if the date of a new commit matches the date of any old commit
-        in a list of old commits.
+        in an index of old commits.
         """
 
-        new_sha, new_commit_message, new_author, new_author_date, _, _ = new_commit
-        for old_sha, old_commit_message, old_author, old_author_date, _, _ in old_commits:
-            if old_author_date == new_author_date and old_author == new_author:
-                self.add_match("Date match", project, old_author, old_sha,
-                               old_commit_message, new_sha, new_commit_message)
-                return True
+        new_sha, new_commit_message, _, _, _, _ = new_commit
+        match = old_commits.match_date(new_commit)
+        if match:
+            old_sha, old_commit_message, old_author, _, _, _ = match
+            self.add_match("Date match", project, old_author, old_sha,
+                           old_commit_message, new_sha, new_commit_message)
+            return True
 
     def match_diff(self, project, new_commit, old_commits):
         """
         Fuzzy comparison of two diffs (changes only)
         """
 
-        new_sha, new_commit_message, _, _, _, new_diff = new_commit
-        for old_sha, old_commit_message, old_author, _, _, old_diff in old_commits:
-            if len(new_diff) <= 10:
-                threshold = 90
-            elif len(new_diff) <= 50:
-                threshold = 80
-            else:
-                threshold = 70
-            ratio = fuzz.ratio(new_diff, old_diff)
-            if ratio > threshold:
-                self.add_match("Diff match", project, old_author, old_sha,
-                               old_commit_message, new_sha, new_commit_message, {"ratio": ratio})
-                return ratio
+        new_sha, new_commit_message, _, _, _, _ = new_commit
+        match = old_commits.match_diff(new_commit)
+        if match:
+            (old_sha, old_commit_message, old_author, _, _, _), ratio = match
+            self.add_match("Diff match", project, old_author, old_sha,
+                           old_commit_message, new_sha, new_commit_message, {"ratio": ratio})
+            return ratio
 
     def match_summary(self, project, new_commit, old_commits):
         """
         Matches the summary of a new commit with the summaries of old commits.
         """
         new_sha, new_commit_message, _, _, _, _ = new_commit
-        for old_sha, old_commit_message, old_author, _, _, _ in old_commits:
-            normalized_old_commit_message = re.sub(self.backport_regex, '', re.sub(
-                self.normalize_regex, '', old_commit_message)).lower()
-            normalized_new_commit_message = re.sub(self.backport_regex, '', re.sub(
-                self.normalize_regex, '', new_commit_message)).lower()
-            if normalized_old_commit_message == normalized_new_commit_message and len(old_commit_message) > 10:
-                self.add_match("Summary match", project, old_author, old_sha,
-                               old_commit_message, new_sha, new_commit_message)
-                return True
+        match = old_commits.match_summary(new_commit)
+        if match:
+            old_sha, old_commit_message, old_author, _, _, _ = match
+            self.add_match("Summary match", project, old_author, old_sha,
+                           old_commit_message, new_sha, new_commit_message)
+            return True
 
     def get_ignored_commits(self):
         commits = []
@@ -1218,62 +1717,54 @@ class MissingCommits:
             return
 
         source_sha, target_sha = change_info
-        missing_cmd_base = [
-            self.git_bin, 'log', '--oneline', '--cherry-pick',
-            '--right-only', '--no-merges'
-        ]
-
-        source_sha = self.get_long_sha(repo_path, source_sha)
-        target_sha = self.get_long_sha(repo_path, target_sha)
 
-        project_dir = self.product_dir / repo_path
+        shas = self.resolve_shas(repo_path, [source_sha, target_sha])
+        source_sha = shas[source_sha]
+        target_sha = shas[target_sha]
 
         # Commits that are in the target manifest but NOT in the source manifest
-        try:
-            target_only_results = self.check_output(
-                missing_cmd_base + [f'{source_sha}...{target_sha}'],
-                cwd=project_dir, stderr=subprocess.STDOUT
-            ).decode().strip()
-        except subprocess.CalledProcessError as exc:
-            traceback.print_exc()
-            raise RuntimeError(f'The "git log" command for project "{repo_path}" '
-                               f'failed: {exc.stdout}') from exc
-
-        get_commit_details = functools.partial(
-            self.get_commit_details, repo_path=repo_path)
-
-        target_only_commits = []
-        if target_only_results:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-                target_only_commits = list(executor.map(
-                    get_commit_details, target_only_results.split("\n")))
+        target_only = self.log_commits(
+            repo_path, f'{source_sha}...{target_sha}')
 
         # Commits that are in the source manifest but NOT in the target manifest
         # (These are the potentially missing commits we're checking for)
-        try:
-            source_only_results = self.check_output(
-                missing_cmd_base + [f'{target_sha}...{source_sha}'],
-                cwd=project_dir, stderr=subprocess.STDOUT
-            ).decode().strip()
-        except subprocess.CalledProcessError as exc:
-            traceback.print_exc()
-            raise RuntimeError(f'The "git log" command for project "{repo_path}" '
-                               f'failed: {exc.stdout}') from exc
+        source_only = self.log_commits(
+            repo_path, f'{target_sha}...{source_sha}')
 
-        source_only_commits = []
-        if source_only_results:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-                source_only_commits = list(executor.map(
-                    get_commit_details, source_only_results.split("\n")))
+        # Diffs are only used to match source-only commits against
+        # target-only ones, so don't fetch any when there's nothing to match
+        with_diffs = bool(target_only and source_only)
+        target_only_commits = self.commit_details(
+            repo_path, target_only, with_diffs)
+        source_only_commits = self.commit_details(
+            repo_path, source_only, with_diffs)
 
         project_name = self.get_project_name(repo_path)
-        if project_name not in self.commits[self.product]:
-            self.commits[self.product
-                         ][project_name] = default_dict_factory()
-            self.commits[self.product][project_name]["url"] = self.project_url(
-                project_name)
+        # Recorded for every pair, not just the first to see the project,
+        # so each pair's stored changes can be replayed on their own;
+        # _apply_project() leaves an existing project alone
+        self.record_change("_apply_project", project_name,
+                           self.project_url(project_name))
+
+        if self.record_commits is not None:
+            # Parallel runs share the file, so append a line at a time
+            with open(self.record_commits, 'a') as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                fh.write(json.dumps({
+                    "project": repo_path,
+                    "source_only": source_only_commits,
+                    "target_only": target_only_commits,
+                }) + os.linesep)
 
         if source_only_commits:
+            target_only_index = CommitIndex(target_only_commits)
+
+            # Look up the tickets every one of these commits names at once,
+            # rather than as we come to each commit
+            self.prefetch_backports(
+                ticket for _, message, _, _, _, _ in source_only_commits
+                for ticket in get_tickets(message))
+
             missing_commits_count = 0
             for commit in source_only_commits:
                 sha, message, author, _, commit_date, _ = commit
@@ -1285,61 +1776,49 @@ class MissingCommits:
                     # This pair proves the commit is present in old_manifest,
                     # which may resolve a missing_from entry left by an
                     # earlier pair that couldn't detect the cherry-pick
-                    if sha in self.commits[self.product][project_name]["TrackedCommits"]:
-                        self._mark_commit_status(project_name, sha, present_in=[self.old_manifest])
+                    self.record_change("_apply_present", project_name, sha,
+                                       self.old_manifest)
                     continue
 
                 backports = self.backports_of(get_tickets(message))
-                is_a_backport = False
+                matches = []
                 if backports:
-                    gitlog = self.Popen(
-                        ['git', 'log', '--oneline', target_sha],
-                        cwd=project_dir,
-                        stdout=subprocess.PIPE)
-                    try:
-                        matches = self.check_output(
-                            ['grep', '-E'] + ['|'.join(backports)], stdin=gitlog.stdout
-                        ).decode("ascii").strip().split("\n")
-                        if len(matches) > 0:
-                            is_a_backport = True
-                    except subprocess.CalledProcessError as exc:
-                        if exc.returncode == 1:
-                            # grep most likely failed to find a match.
-                            pass
-                        else:
-                            self.log.warning(f"Exception: {exc.output}")
-
-                if is_a_backport:
-                    self.matched_commits += 1
+                    index = self.ticket_index(repo_path, target_sha)
+                    for ticket in set(backports):
+                        matches.extend(index.get(ticket, []))
+
+                if matches:
+                    # Show them in history order, as 'git log' would
+                    self.record_change("_apply_backport")
                     self.add_match("Backport", project_name, author, sha, message, sha, message, {"backports": {
-                        match.split(" ")[0]: match.split(" ", 1)[1] for match in matches
+                        match_sha: match_message
+                        for _, match_sha, match_message in sorted(matches)
                     }})
                     continue
 
-                if (self.match_summary(project_name, commit, target_only_commits) or
-                        self.match_date(project_name, commit, target_only_commits) or
-                        self.match_diff(project_name, commit, target_only_commits)):
+                if (self.match_summary(project_name, commit, target_only_index) or
+                        self.match_date(project_name, commit, target_only_index) or
+                        self.match_diff(project_name, commit, target_only_index)):
                     continue
 
-                if sha not in self.commits[self.product][project_name]["TrackedCommits"]:
-                    # Resolve who to notify now, while the checkout this
-                    # commit came from is still around - repo_sync() replaces
-                    # it for every manifest pair, so by the time we come to
-                    # notify it may well be gone
-                    self.commits[self.product][project_name]["TrackedCommits"][sha] = {
-                        "present_in": [],
-                        "missing_from": [],
-                        "author": author,
-                        "notify": self.notify_email(
-                            repo_path, self.get_long_sha(repo_path, sha),
-                            author),
-                        "message": message,
-                        "date": commit_date,
-                    }
-
-                self._mark_commit_status(project_name, sha,
-                                        present_in=[self.old_manifest],
-                                        missing_from=[self.new_manifest])
+                # Resolve who to notify now, while the checkout this
+                # commit came from is still around - repo_sync() replaces
+                # it for every manifest pair, so by the time we come to
+                # notify it may well be gone.  The details are only used if
+                # the commit isn't tracked already, so don't go looking
+                # (possibly asking Gerrit) if it is
+                notify = None
+                if not self.is_tracked(project_name, sha):
+                    notify = self.notify_email(
+                        repo_path, self.get_long_sha(repo_path, sha), author)
+                self.record_change("_apply_missing", project_name, sha, {
+                    "present_in": [],
+                    "missing_from": [],
+                    "author": author,
+                    "notify": notify,
+                    "message": message,
+                    "date": commit_date,
+                }, self.old_manifest, self.new_manifest)
                 missing_commits_count += 1
             self.log.info(
                 f"Missing commits for {project_name}: {missing_commits_count}")
@@ -1424,6 +1903,119 @@ class MissingCommits:
                     f"Would have notified the following users: {', '.join(self.notified_users)} about {self.total_missing} missing commits")
 
 
+# The MissingCommits instance of a worker process in a parallel run
+worker_checker = None
+
+
+def setup_logger(debug):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+
+    ch = logging.StreamHandler()
+    if not debug:
+        ch.setLevel(logging.INFO)
+
+    logger.addHandler(ch)
+    return logger
+
+
+def init_pair_worker(slots, checker_args):
+    """
+    Set up a worker process for compare_pairs_in_parallel().  Each worker
+    takes a numbered slot and works in a directory named after it, so its
+    checkout and 'new.xml' don't collide with any other worker's - and with
+    --reuse_checkout, a later run's worker in the same slot picks up the
+    checkout this one leaves behind
+    """
+
+    global worker_checker
+
+    slot = slots.get()
+    workdir = pathlib.Path(f"pair-worker-{slot}")
+    workdir.mkdir(exist_ok=True)
+    os.chdir(workdir)
+
+    logger = setup_logger(checker_args["debug"])
+    worker_checker = MissingCommits(logger, **checker_args)
+    worker_checker.queued_changes = []
+
+
+def compare_pair(old_manifest, new_manifest):
+    """
+    Compare a pair of manifests in a worker process, returning the changes
+    to make to the results along with the projects which couldn't be
+    compared and any authors attributed along the way
+    """
+
+    worker_checker.queued_changes = []
+    worker_checker.skipped_projects = []
+    worker_checker.project_results = {}
+    worker_checker.reused_projects = 0
+    known_authors = dict(worker_checker.resolved_authors)
+
+    try:
+        worker_checker.identify_missing_commits(old_manifest, new_manifest)
+    except Exception:
+        traceback.print_exc()
+        raise
+
+    resolved_authors = {
+        author: owner
+        for author, owner in worker_checker.resolved_authors.items()
+        if known_authors.get(author) != owner
+    }
+    return (worker_checker.queued_changes, worker_checker.skipped_projects,
+            resolved_authors, worker_checker.project_results,
+            worker_checker.reused_projects)
+
+
+def compare_pairs_in_parallel(commit_checker, comparisons, jobs,
+                              checker_args):
+    """
+    Compare manifest pairs in a pool of worker processes.  Their results
+    are merged into commit_checker in the order the pairs are listed in,
+    whatever order they finish in, so the outcome is the same as comparing
+    them one after another.  Returns the comparisons which failed
+    """
+
+    failed_comparisons = []
+
+    # Workers are spawned rather than forked, so they don't inherit the
+    # parent's Jira session or commit cache connection
+    context = multiprocessing.get_context("spawn")
+    slots = context.Queue()
+    for slot in range(jobs):
+        slots.put(slot)
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, mp_context=context,
+            initializer=init_pair_worker,
+            initargs=(slots, checker_args)) as executor:
+        futures = [
+            executor.submit(compare_pair, a, b) for a, b in comparisons
+        ]
+
+        for (a, b), future in zip(comparisons, futures):
+            try:
+                (changes, skipped_projects, resolved_authors, project_results,
+                 reused_projects) = future.result()
+            except Exception as exc:
+                commit_checker.log.error(
+                    f"Comparison of {a} and {b} failed, continuing with the "
+                    f"remaining manifests")
+                failed_comparisons.append((a, b, exc))
+                continue
+
+            commit_checker.apply_changes(changes)
+            commit_checker.skipped_projects.extend(skipped_projects)
+            commit_checker.project_results.update(project_results)
+            commit_checker.reused_projects += reused_projects
+            for author, owner in resolved_authors.items():
+                commit_checker.resolved_authors.setdefault(author, owner)
+
+    return failed_comparisons
+
+
 def main():
     """
     Parse the command line, initialize logging and key information,
@@ -1458,31 +2050,78 @@ def main():
     parser.add_argument('--compare_builds', action='store_true', default=False,
                         help='Compare two specific builds')
     parser.add_argument('--manifest_repo', help='Git URL to manifest repo')
+    parser.add_argument('--commit_cache',
+                        help='Path to the commit metadata cache (defaults to '
+                             'a file under the reporef directory)')
+    parser.add_argument('--no_commit_cache', action='store_true',
+                        help='Do not use the commit metadata cache')
+    parser.add_argument('--reuse_checkout', action='store_true',
+                        help='Keep one checkout and re-point it at each '
+                             'manifest, rather than replacing it')
+    parser.add_argument('--record_commits',
+                        help='Append the commits compared for each project '
+                             'to this JSON Lines file, for match_benchmark')
+    parser.add_argument('--jira_cache_ttl', type=float, default=0,
+                        help='Hours to keep Jira backport links in the '
+                             'commit cache between runs (default: only for '
+                             'the current run)')
+    parser.add_argument('--results',
+                        help='Write every tracked and matched commit to this '
+                             'JSON Lines file')
+    parser.add_argument('--since_previous', action='store_true',
+                        help='Reuse the comparisons in the --results file '
+                             'left by the previous run where nothing has '
+                             'changed')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of manifest pairs to compare at once, '
+                             'each in a checkout of its own')
     parser.add_argument('product', help='Product to check')
     args = parser.parse_args()
 
     # Set up logging
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)
-
-    ch = logging.StreamHandler()
-    if not args.debug:
-        ch.setLevel(logging.INFO)
-
-    logger.addHandler(ch)
-
-    # Setup file paths and search for missing commits
-    manifest_dir = pathlib.Path(args.manifest_dir)
-    reporef_dir = pathlib.Path(args.reporef_dir)
-
-    commit_checker = MissingCommits(
-        logger, args.product, manifest_dir, args.manifest_repo,
-        args.first_manifest, args.last_manifest,
-        reporef_dir, args.targeted_projects, args.debug,
-        args.show_matches, args.only_boundaries,
-        args.compare_builds, args.notify
+    logger = setup_logger(args.debug)
+
+    # Setup file paths and search for missing commits.  Paths are made
+    # absolute, as parallel workers each run in a directory of their own
+    manifest_dir = pathlib.Path(args.manifest_dir).resolve()
+    reporef_dir = pathlib.Path(args.reporef_dir).resolve()
+
+    # The reporef directory persists between runs, so the cache does too
+    if args.no_commit_cache:
+        commit_cache = None
+    elif args.commit_cache:
+        commit_cache = pathlib.Path(args.commit_cache).resolve()
+    else:
+        commit_cache = (reporef_dir / ".find_missing_commits"
+                        / f"{args.product}-commits.sqlite3")
+
+    if args.since_previous and not args.results:
+        parser.error("--since_previous needs --results")
+
+    results = None
+    if args.results:
+        results = pathlib.Path(args.results).resolve()
+
+    record_commits = None
+    if args.record_commits:
+        record_commits = pathlib.Path(args.record_commits).resolve()
+
+    checker_args = dict(
+        product=args.product, manifest_dir=manifest_dir,
+        manifest_repo=args.manifest_repo,
+        first_manifest=args.first_manifest, last_manifest=args.last_manifest,
+        reporef_dir=reporef_dir, targeted_projects=args.targeted_projects,
+        debug=args.debug, show_matches=args.show_matches,
+        only_boundaries=args.only_boundaries,
+        compare_builds=args.compare_builds, notify=args.notify,
+        commit_cache=commit_cache, record_commits=record_commits,
+        reuse_checkout=args.reuse_checkout,
+        jira_cache_ttl=args.jira_cache_ttl, results=results,
+        since_previous=args.since_previous
     )
 
+    commit_checker = MissingCommits(logger, **checker_args)
+
     manifest_missing = False
     if not args.compare_builds and args.first_manifest and args.first_manifest not in commit_checker.manifests:
         manifest_missing = True
@@ -1546,15 +2185,28 @@ def main():
             continue
         comparisons.append((a, b))
 
-    for a, b in comparisons:
-        try:
-            commit_checker.identify_missing_commits(a, b)
-        except Exception as exc:
-            traceback.print_exc()
-            logger.error(
-                f"Comparison of {a} and {b} failed, continuing with the "
-                f"remaining manifests")
-            failed_comparisons.append((a, b, exc))
+    if args.jobs > 1 and len(comparisons) > 1:
+        failed_comparisons = compare_pairs_in_parallel(
+            commit_checker, comparisons, min(args.jobs, len(comparisons)),
+            checker_args)
+    else:
+        for a, b in comparisons:
+            try:
+                commit_checker.identify_missing_commits(a, b)
+            except Exception as exc:
+                traceback.print_exc()
+                logger.error(
+                    f"Comparison of {a} and {b} failed, continuing with the "
+                    f"remaining manifests")
+                failed_comparisons.append((a, b, exc))
+
+    if commit_checker.commit_cache is not None:
+        commit_checker.commit_cache.close()
+
+    logger.debug(f"Made {commit_checker.jira_requests} Jira requests")
+
+    if commit_checker.results_path is not None:
+        commit_checker.write_results(failed_comparisons)
 
     if commit_checker.matched_commits > 0:
         print(f"Matched {commit_checker.matched_commits} commits")
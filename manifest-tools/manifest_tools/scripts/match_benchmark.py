@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Replay commit sets recorded by 'find_missing_commits --record_commits'
+through the commit matcher, timing the indexed lookups in CommitIndex
+against the plain linear comparison they replace, and checking both come
+to the same conclusion for every commit.
+"""
+import argparse
+import json
+import sys
+import time
+
+from thefuzz import fuzz
+
+from manifest_tools.scripts.commit_matcher import (
+    CommitIndex, diff_threshold, normalize_summary)
+
+
+def linear_match(commit, old_commits):
+    """
+    Match a commit against a list of commits one at a time, the way
+    find_missing_commits did before CommitIndex.  Returns the match type and
+    the SHA of the commit matched, or None
+    """
+
+    _, message, author, author_date, _, diff_changes = commit
+
+    for old_sha, old_message, _, _, _, _ in old_commits:
+        if (normalize_summary(old_message) == normalize_summary(message)
+                and len(old_message) > 10):
+            return ("Summary match", old_sha)
+
+    for old_sha, _, old_author, old_author_date, _, _ in old_commits:
+        if old_author_date == author_date and old_author == author:
+            return ("Date match", old_sha)
+
+    threshold = diff_threshold(diff_changes)
+    for old_sha, _, _, _, _, old_diff in old_commits:
+        if fuzz.ratio(diff_changes, old_diff) > threshold:
+            return ("Diff match", old_sha)
+
+    return None
+
+
+def indexed_match(commit, index):
+    """
+    Match a commit against a CommitIndex, returning the same as
+    linear_match()
+    """
+
+    match = index.match_summary(commit)
+    if match:
+        return ("Summary match", match[0])
+
+    match = index.match_date(commit)
+    if match:
+        return ("Date match", match[0])
+
+    match = index.match_diff(commit)
+    if match:
+        return ("Diff match", match[0][0])
+
+    return None
+
+
+def load_recording(path):
+    """
+    Read a recording, turning each commit back into the tuple the matcher
+    expects
+    """
+
+    recording = []
+    with open(path) as fh:
+        for line in fh:
+            entry = json.loads(line)
+            recording.append((
+                entry["project"],
+                [tuple(commit) for commit in entry["source_only"]],
+                [tuple(commit) for commit in entry["target_only"]],
+            ))
+    return recording
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the commit matcher against recorded commits'
+    )
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='Number of times to replay the recording')
+    parser.add_argument('recording',
+                        help='JSON Lines file written by --record_commits')
+    args = parser.parse_args()
+
+    recording = load_recording(args.recording)
+    commits = sum(len(source_only) for _, source_only, _ in recording)
+    print(f"Replaying {len(recording)} projects, {commits} source-only "
+          f"commits, {args.repeat} time(s)")
+
+    linear_time = 0.0
+    indexed_time = 0.0
+    mismatches = 0
+
+    for _ in range(args.repeat):
+        for project, source_only, target_only in recording:
+            start = time.perf_counter()
+            expected = [linear_match(commit, target_only)
+                        for commit in source_only]
+            linear_time += time.perf_counter() - start
+
+            # Building the index is part of the cost of using it
+            start = time.perf_counter()
+            index = CommitIndex(target_only)
+            actual = [indexed_match(commit, index) for commit in source_only]
+            indexed_time += time.perf_counter() - start
+
+            for commit, want, got in zip(source_only, expected, actual):
+                if want != got:
+                    mismatches += 1
+                    print(f"MISMATCH in {project} for [{commit[0]}] "
+                          f"{commit[1]}: linear {want}, indexed {got}")
+
+    print(f"Linear:  {linear_time:.3f}s")
+    print(f"Indexed: {indexed_time:.3f}s")
+    if indexed_time:
+        print(f"Speedup: {linear_time / indexed_time:.1f}x")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
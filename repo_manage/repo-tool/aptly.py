@@ -14,7 +14,8 @@ import requests
 import subprocess
 import sys
 from collections import defaultdict
-from typing import ClassVar, Dict, NamedTuple, Optional, Set
+from pkginfo import PackageInfo, read_package_info
+from typing import ClassVar, Dict, List, NamedTuple, Optional, Set, Union
 from util import Action, render_template, run, run_output
 
 
@@ -63,6 +64,12 @@ class Aptly:
         self.repos.update(self.ask_aptly("repo list -raw").split())
         logging.debug(f"Found following aptly repos: {self.repos}")
 
+        # Contents of each repository and the list of existing publishes,
+        # each read from aptly at most once per run and then kept up to
+        # date as we make changes
+        self.repo_packages: Dict[str, Set[str]] = {}
+        self.publishes: Optional[Set[str]] = None
+
         self.dirty_repos: Dict[AptlyRepo, Set[pathlib.Path]] = defaultdict(set)
 
 
@@ -75,13 +82,35 @@ class Aptly:
         return run_output(f"aptly -config {self.config_file} {cmd}")
 
 
-    def run_aptly(self, cmd: str, **kwargs) -> subprocess.CompletedProcess:
+    def run_aptly(
+        self, cmd: Union[str, List[str]], **kwargs
+    ) -> subprocess.CompletedProcess:
         """
         Convenience function to run an 'aptly' command with the specified
-        config file
+        config file. cmd may be a list if any arguments contain whitespace.
+        """
+
+        if type(cmd) == str:
+            cmd = cmd.split()
+        return run(["aptly", "-config", str(self.config_file), *cmd], **kwargs)
+
+
+    def packages_in(self, repo: AptlyRepo) -> Set[str]:
+        """
+        Returns the set of package references (name_version_arch) in a
+        repository, asking aptly only the first time for each repository
         """
 
-        return run(f"aptly -config {self.config_file} {cmd}", **kwargs)
+        name = str(repo)
+        if not name in self.repo_packages:
+            packages: Set[str] = set()
+            if name in self.repos:
+                logging.debug(f"Reading package list of aptly repo {repo}")
+                output = self.ask_aptly(f"repo show -with-packages {repo}")
+                (_, _, listing) = output.partition("Packages:")
+                packages.update(listing.split())
+            self.repo_packages[name] = packages
+        return self.repo_packages[name]
 
 
     def create_repo(self, repo: AptlyRepo) -> None:
@@ -93,27 +122,52 @@ class Aptly:
         self.run_aptly(
             f"repo create -distribution {repo.distro} -component main {repo}"
         )
-        self.repos.update(self.ask_aptly("repo list -raw").split())
+        self.repos.add(str(repo))
+
 
+    # Maximum number of packages to pass to a single 'aptly repo add' or
+    # 'aptly repo remove', to stay well clear of command-line length limits
+    batch_size: ClassVar[int] = 500
 
-    def commit_package(self, repo: AptlyRepo, debact: DebAction) -> None:
+    def commit_packages(
+        self, repo: AptlyRepo, debactions: Set[DebAction]
+    ) -> None:
         """
-        Imports/Removes a package file in a specified Aptly repository,
-        creating said repository if necessary
+        Imports/Removes a set of package files in a specified Aptly
+        repository, creating said repository if necessary. All removals
+        are done first, in as few aptly invocations as possible, followed
+        by all imports.
         """
 
         if not str(repo) in self.repos:
             self.create_repo(repo)
 
-        match debact.action:
-            case Action.ADD:
-                pkgfile = debact.pkgfile
-                logging.info(f"Importing {pkgfile} into aptly repo {repo}")
-                self.run_aptly(f"repo add {repo} {pkgfile}")
-            case Action.REMOVE:
-                pkgref = debact.pkgref()
+        packages = self.packages_in(repo)
+        ordered = sorted(debactions, key=lambda debact: str(debact.pkgfile))
+
+        pkgrefs = [
+            debact.pkgref() for debact in ordered
+            if debact.action == Action.REMOVE
+        ]
+        for i in range(0, len(pkgrefs), self.batch_size):
+            batch = pkgrefs[i:i + self.batch_size]
+            for pkgref in batch:
                 logging.info(f"Removing {pkgref} from aptly repo {repo}")
-                self.run_aptly(f"repo remove {repo} {pkgref}")
+            self.run_aptly(["repo", "remove", str(repo), *batch])
+            packages.difference_update(batch)
+
+        adds = [debact for debact in ordered if debact.action == Action.ADD]
+        for i in range(0, len(adds), self.batch_size):
+            batch = adds[i:i + self.batch_size]
+            for debact in batch:
+                logging.info(
+                    f"Importing {debact.pkgfile} into aptly repo {repo}"
+                )
+            self.run_aptly([
+                "repo", "add", str(repo),
+                *[str(debact.pkgfile) for debact in batch]
+            ])
+            packages.update(debact.pkgref() for debact in batch)
 
 
     def update_repo(self, repo: AptlyRepo) -> None:
@@ -126,15 +180,18 @@ class Aptly:
         # existing publish set up for this already.
         fspath = f"filesystem:{repo.target}:."
         publish = f"{fspath} {repo.distro}"
-        publishes: Set[str] = set()
-        publishes.update(self.ask_aptly("publish list -raw").split('\n'))
-        if not publish in publishes:
+        if self.publishes is None:
+            self.publishes = set(
+                self.ask_aptly("publish list -raw").split('\n')
+            )
+        if not publish in self.publishes:
             logging.info(f"Publishing local apt repository {repo}")
             self.run_aptly(
                 f"publish repo -acquire-by-hash "
                 f"-gpg-key {self.gpg_key} "
                 f"{repo} {fspath}"
             )
+            self.publishes.add(publish)
         else:
             logging.info(f"Updating local apt repository {repo}")
             self.run_aptly(
@@ -227,11 +284,13 @@ class Aptly:
     debugre: ClassVar[re.Pattern] = re.compile("dbg_")
 
     def add_action(
-        self, target: str, distro: str, pkgfile: pathlib.Path, action: Action
+        self, target: str, distro: str, pkgfile: pathlib.Path, action: Action,
+        pkginfo: Optional[PackageInfo] = None
     ) -> Optional[str]:
         """
         Represents a request to add a .deb to a specified repository. Returns
-        the full name of the repository.
+        the full name of the repository. If pkginfo isn't passed, it will be
+        read from the .deb.
         """
 
         # Don't add debug files
@@ -244,22 +303,20 @@ class Aptly:
             distro = self.detect_distro(pkgfile)
 
         # Obtain package information from .deb file, and save as an Action
+        if pkginfo is None:
+            pkginfo = read_package_info(pkgfile)
         debact = DebAction(
-            run_output(f"dpkg-deb -f {pkgfile} Package").strip(),
-            run_output(f"dpkg-deb -f {pkgfile} Version").strip(),
-            run_output(f"dpkg-deb -f {pkgfile} Architecture").strip(),
+            pkginfo.name,
+            pkginfo.version,
+            pkginfo.arch,
             pkgfile,
             distro,
             action
         )
 
-        # Ask aptly if it knows this package
+        # See if aptly knows this package
         repo = AptlyRepo(target, distro)
-        result = self.run_aptly(
-            f"repo search {repo} {debact.pkgref()}",
-            check=False
-        )
-        exists = result.returncode == 0
+        exists = debact.pkgref() in self.packages_in(repo)
 
         # Don't record an action that won't do anything
         if action == Action.ADD and exists:
@@ -279,9 +336,10 @@ class Aptly:
         Processes all queued add_package requests
         """
 
+        # dirty_repos has one entry per target:distro, so each touched
+        # distro is published exactly once
         for (repo, debactions) in self.dirty_repos.items():
-            for debact in debactions:
-                self.commit_package(repo, debact)
+            self.commit_packages(repo, debactions)
             self.update_repo(repo)
             self.write_listfile(repo)
 
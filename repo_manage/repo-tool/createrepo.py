@@ -5,14 +5,17 @@ Simple wrapper around the createrepo_c command-line utility.
 """
 
 import logging
+import os
 import pathlib
 import re
 import shutil
 import sys
 
 from collections import defaultdict
-from util import Action, render_template, run, run_output
-from typing import ClassVar, Dict, NamedTuple, Optional, Set
+from concurrent.futures import ThreadPoolExecutor
+from pkginfo import PackageInfo, read_package_info
+from util import Action, render_template, run
+from typing import ClassVar, Dict, NamedTuple, Optional, Set, Tuple
 
 
 class RpmAction(NamedTuple):
@@ -51,6 +54,16 @@ class Createrepo:
         def __repr__(self) -> str:
             return f"{self.target}:{self.distro}:{self.arch}"
 
+        # Equal YumRepos must share a dirty_repos entry, so that each
+        # on-disk repository is only updated once (and never by two
+        # concurrent createrepo_c processes)
+        def __eq__(self, other: object) -> bool:
+            return isinstance(other, Createrepo.YumRepo) \
+                and repr(self) == repr(other)
+
+        def __hash__(self) -> int:
+            return hash(repr(self))
+
         def repo_dir(self) -> pathlib.Path:
             return self.dir
 
@@ -62,19 +75,30 @@ class Createrepo:
         self.dirty_repos: Dict[Createrepo.YumRepo, Set[pathlib.Path]] = \
             defaultdict(set)
 
+        # Signing and createrepo_c are both CPU-bound, so size everything
+        # to the host
+        self.workers: int = os.cpu_count() or 1
 
-    def commit_package(self, repo: YumRepo, rpmact: RpmAction) -> None:
+
+    def init_repo(self, repo: YumRepo) -> None:
         """
-        Imports/Removes a package file in a specified yum repository, creating
-        said repository if necessary. Signs the RPM on the way in.
+        Ensures the directory for a specified yum repository exists
         """
 
-        # First ensure repository directory exists
         repo_dir = repo.repo_dir()
         if not repo_dir.is_dir():
             logging.info(f"Initializing yum repo {repo_dir}")
             repo_dir.mkdir(exist_ok=True, parents=True)
 
+
+    def commit_package(self, repo: YumRepo, rpmact: RpmAction) -> None:
+        """
+        Imports/Removes a package file in a specified yum repository, which
+        must already exist. Signs the RPM on the way in. Safe to call
+        concurrently for different packages.
+        """
+
+        repo_dir = repo.repo_dir()
         match rpmact.action:
             case Action.ADD:
                 # Copy the .rpm into target directory - use regular copy so the
@@ -97,14 +121,18 @@ class Createrepo:
                 rpmact.repofile.unlink()
 
 
-    def update_repo(self, repo: YumRepo) -> None:
+    def update_repo(self, repo: YumRepo, workers: int) -> None:
         """
-        Updates yum metadata in specified yum repository
+        Updates yum metadata in specified yum repository, using the
+        specified number of createrepo_c worker threads
         """
 
         repo_dir = repo.repo_dir()
         logging.info(f"Updating yum metadata in repo {repo_dir}")
-        run(f"createrepo_c --update --retain-old-md=5 --compatibility {repo_dir}")
+        run(
+            f"createrepo_c --update --retain-old-md=5 --compatibility "
+            f"--workers {workers} {repo_dir}"
+        )
 
         # GPG sign the repomd
         repomdfile = repo_dir / "repodata" / "repomd.xml"
@@ -178,11 +206,13 @@ class Createrepo:
     debugre: ClassVar[re.Pattern] = re.compile("debuginfo|asan")
 
     def add_action(
-        self, target: str, distro: str, pkgfile: pathlib.Path, action: Action
+        self, target: str, distro: str, pkgfile: pathlib.Path, action: Action,
+        pkginfo: Optional[PackageInfo] = None
     ) -> Optional[str]:
         """
         Represents a request to add a .rpm to a specified repository. Returns
-        the full name of the repository.
+        the full name of the repository. If pkginfo isn't passed, it will be
+        read from the .rpm.
         """
 
         # Don't add debug files
@@ -201,8 +231,9 @@ class Createrepo:
         # Check repository to see if this rpm already exists (can't actually
         # check if it's "the same file" or not because the one in repo_dir will
         # be signed)
-        arch = run_output(f'rpm --qf %{{arch}} -qp {str(pkgfile)}').strip()
-        repo = Createrepo.YumRepo(target, distro, arch)
+        if pkginfo is None:
+            pkginfo = read_package_info(pkgfile)
+        repo = Createrepo.YumRepo(target, distro, pkginfo.arch)
         repo_dir = repo.repo_dir()
         repofile = repo_dir / pkgfile.name
         exists = repofile.exists()
@@ -232,11 +263,55 @@ class Createrepo:
         Processes all queued add_package requests
         """
 
-        for (repo, rpmactions) in self.dirty_repos.items():
-            for rpmact in rpmactions:
-                self.commit_package(repo, rpmact)
-            self.update_repo(repo)
+        if not self.dirty_repos:
+            return
 
+        for repo in self.dirty_repos:
+            self.init_repo(repo)
+
+        # Two package files with the same name would be copied to the same
+        # file in the repository, so only one action per repository file
+        # can go ahead - otherwise two threads would be copying and signing
+        # the same file at once
+        pending: Dict[pathlib.Path, Tuple[Createrepo.YumRepo, RpmAction]] = {}
+        for (repo, rpmactions) in self.dirty_repos.items():
+            for rpmact in sorted(
+                rpmactions, key=lambda a: (str(a.pkgfile), a.action.name)
+            ):
+                if rpmact.repofile in pending:
+                    dropped = pending[rpmact.repofile][1]
+                    logging.warning(
+                        f"Dropping request to {dropped.action.name} "
+                        f"{dropped.pkgfile}, as {rpmact.pkgfile} is also "
+                        f"going to {rpmact.repofile}"
+                    )
+                pending[rpmact.repofile] = (repo, rpmact)
+
+        # Copy and sign all packages, across all repositories, in parallel -
+        # gpg-agent is happy to handle concurrent signing requests. Using
+        # .result() ensures any failure is raised here.
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self.commit_package, repo, rpmact)
+                for (repo, rpmact) in pending.values()
+            ]
+            for future in futures:
+                future.result()
+
+        # Each target:distro:arch is an independent yum repository, so update
+        # their metadata concurrently, sharing the host's CPUs among the
+        # createrepo_c processes
+        repos = list(self.dirty_repos)
+        workers = max(1, self.workers // len(repos))
+        with ThreadPoolExecutor(max_workers=len(repos)) as executor:
+            futures = [
+                executor.submit(self.update_repo, repo, workers)
+                for repo in repos
+            ]
+            for future in futures:
+                future.result()
+
+        for repo in repos:
             # We may end up calling this redundantly if we have RPMs for
             # multiple architectures in the same target:distro, but it's
             # easier just call this every time - it's cheap enough to
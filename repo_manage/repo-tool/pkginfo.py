@@ -0,0 +1,182 @@
+"""
+In-process readers for the handful of package fields repo-tool needs
+from .deb and .rpm files, so that pre-processing a large drop of
+packages doesn't mean forking dpkg-deb or rpm several times per file.
+"""
+
+import io
+import logging
+import pathlib
+import struct
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterable, NamedTuple
+from util import run
+
+
+class PackageInfo(NamedTuple):
+    name: str
+    version: str
+    arch: str
+
+
+def _deb_control_member(fh: BinaryIO) -> tuple:
+    """
+    Returns (name, data) for the control.tar member of a .deb, which on
+    the outside is just an ar(1) archive. Other members (notably the
+    possibly very large data.tar) are skipped over without being read.
+    """
+
+    if fh.read(8) != b"!<arch>\n":
+        raise ValueError("not an ar archive")
+
+    while True:
+        header = fh.read(60)
+        if len(header) < 60:
+            raise ValueError("no control.tar member")
+        name = header[0:16].decode().strip().rstrip("/")
+        size = int(header[48:58].decode().strip())
+        if name.startswith("control.tar"):
+            return (name, fh.read(size))
+        # Members are aligned on even offsets
+        fh.seek(size + size % 2, io.SEEK_CUR)
+
+
+def _decompress_control(name: str, data: bytes) -> bytes:
+    """
+    Returns the uncompressed control.tar from a .deb control member
+    """
+
+    if name.endswith(".zst"):
+        # Python has no zstd support of its own; still only one fork
+        # rather than one per field
+        return run(
+            ["zstd", "-dc"], input=data, capture_output=True
+        ).stdout
+    # tarfile handles plain, gzip and xz itself
+    return data
+
+
+def read_deb_control(pkgfile: pathlib.Path) -> Dict[str, str]:
+    """
+    Returns the fields of the control file of a .deb, as `dpkg-deb -f`
+    would report them
+    """
+
+    with pkgfile.open("rb") as fh:
+        (name, data) = _deb_control_member(fh)
+    control_tar = _decompress_control(name, data)
+
+    with tarfile.open(fileobj=io.BytesIO(control_tar)) as tar:
+        for member in tar:
+            if member.name in ("./control", "control"):
+                control = tar.extractfile(member).read().decode()
+                break
+        else:
+            raise ValueError("no control file in control.tar")
+
+    # Continuation lines (starting with whitespace) belong to the
+    # previous field; we only want the simple fields so just skip them
+    fields: Dict[str, str] = {}
+    for line in control.splitlines():
+        if not line or line[0].isspace() or ":" not in line:
+            continue
+        (key, value) = line.split(":", 1)
+        fields[key.strip()] = value.strip()
+    return fields
+
+
+# RPM header tags we care about, and the data types they may be stored as
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_ARCH = 1022
+RPM_STRING_TYPES = (6, 8, 9)  # STRING, STRING_ARRAY, I18NSTRING
+
+
+def _read_rpm_header(fh: BinaryIO) -> tuple:
+    """
+    Reads one RPM header structure from the current position, returning
+    (index entries, data store)
+    """
+
+    preamble = fh.read(16)
+    if len(preamble) < 16 or preamble[0:3] != b"\x8e\xad\xe8":
+        raise ValueError("bad RPM header magic")
+    (nindex, hsize) = struct.unpack(">II", preamble[8:16])
+    index = fh.read(nindex * 16)
+    store = fh.read(hsize)
+    if len(index) != nindex * 16 or len(store) != hsize:
+        raise ValueError("truncated RPM header")
+    return (
+        [struct.unpack(">iiii", index[i:i+16])
+            for i in range(0, len(index), 16)],
+        store
+    )
+
+
+def read_rpm_tags(pkgfile: pathlib.Path) -> Dict[int, str]:
+    """
+    Returns the string-valued tags from the main header of an .rpm, keyed
+    by tag number. For array/i18n tags, only the first value is kept.
+    """
+
+    with pkgfile.open("rb") as fh:
+        lead = fh.read(96)
+        if len(lead) < 96 or lead[0:4] != b"\xed\xab\xee\xdb":
+            raise ValueError("not an RPM file")
+
+        # Signature header comes first, padded out to an 8-byte boundary
+        (index, store) = _read_rpm_header(fh)
+        fh.read((8 - len(store) % 8) % 8)
+
+        (index, store) = _read_rpm_header(fh)
+
+    tags: Dict[int, str] = {}
+    for (tag, datatype, offset, _) in index:
+        if datatype in RPM_STRING_TYPES:
+            end = store.index(b"\0", offset)
+            tags[tag] = store[offset:end].decode()
+    return tags
+
+
+def read_package_info(pkgfile: pathlib.Path) -> PackageInfo:
+    """
+    Returns name, version and architecture of a .deb or .rpm file. For
+    .debs, version is the full Debian version; for .rpms, it is
+    version-release.
+    """
+
+    try:
+        if pkgfile.suffix == ".deb":
+            fields = read_deb_control(pkgfile)
+            return PackageInfo(
+                fields["Package"], fields["Version"], fields["Architecture"]
+            )
+        elif pkgfile.suffix == ".rpm":
+            tags = read_rpm_tags(pkgfile)
+            return PackageInfo(
+                tags[RPMTAG_NAME],
+                f"{tags[RPMTAG_VERSION]}-{tags[RPMTAG_RELEASE]}",
+                tags[RPMTAG_ARCH]
+            )
+    except (ValueError, KeyError, struct.error, tarfile.TarError) as e:
+        raise ValueError(f"Cannot read package metadata from {pkgfile}: {e!r}")
+    raise ValueError(f"{pkgfile} is not a package file")
+
+
+def read_all_package_info(
+    pkgfiles: Iterable[pathlib.Path]
+) -> Dict[pathlib.Path, PackageInfo]:
+    """
+    Reads package info for many package files concurrently. Decompression
+    and file I/O both release the GIL, so threads are enough here.
+    """
+
+    pkgfiles = list(pkgfiles)
+    if not pkgfiles:
+        return {}
+
+    logging.debug(f"Reading package metadata from {len(pkgfiles)} files")
+    with ThreadPoolExecutor() as executor:
+        return dict(zip(pkgfiles, executor.map(read_package_info, pkgfiles)))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""
+Tests for pkginfo.py, checking that the metadata it reads from package
+files in-process is what `dpkg-deb -f` and `rpm -qp` report for them.
+Run it with ./test_pkginfo.py
+
+The fixture packages are built on the fly: .debs by dpkg-deb itself, in
+each of the compression formats it offers for control.tar, and an .rpm
+by hand (there's no payload, just the lead and the two headers, which is
+all pkginfo or `rpm -qp` look at). Comparisons against a tool which
+isn't installed are skipped; the .rpm's tags are still checked against
+the values it was built with.
+"""
+
+import hashlib
+import json
+import pathlib
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+
+from pkginfo import (
+    PackageInfo, read_all_package_info, read_deb_control, read_package_info,
+    read_rpm_tags, RPMTAG_ARCH, RPMTAG_NAME, RPMTAG_RELEASE, RPMTAG_VERSION,
+)
+
+CONTROL = """\
+Package: couchbase-server
+Version: 7.6.2-3721
+Architecture: amd64
+Maintainer: Couchbase <support@couchbase.com>
+Installed-Size: 1024
+Description: Couchbase Server
+ The continuation lines of a multi-line field
+ .
+ aren't fields of their own.
+"""
+
+RPM_TAGS = {
+    RPMTAG_NAME: "couchbase-server",
+    RPMTAG_VERSION: "7.6.2",
+    RPMTAG_RELEASE: "3721",
+    RPMTAG_ARCH: "x86_64",
+}
+
+FAILURES = []
+
+
+def check(label, got, want):
+    if got == want:
+        print(f"  ok   {label}")
+        return
+    FAILURES.append(label)
+    print(f"  FAIL {label}")
+    print(f"         got: {json.dumps(got)}")
+    print(f"        want: {json.dumps(want)}")
+
+
+def skip(label, why):
+    print(f"  skip {label}: {why}")
+
+
+def build_deb(workdir, compression):
+    """
+    Build a package with the fixture control file, with its members
+    compressed as given, using dpkg-deb
+    """
+
+    root = workdir / f"root-{compression}"
+    (root / "DEBIAN").mkdir(parents=True)
+    (root / "DEBIAN" / "control").write_text(CONTROL)
+    (root / "opt").mkdir()
+    (root / "opt" / "README").write_text("payload\n")
+
+    pkgfile = workdir / f"couchbase-server-{compression}.deb"
+    subprocess.run(
+        ["dpkg-deb", "--root-owner-group", f"-Z{compression}",
+         "--build", str(root), str(pkgfile)],
+        check=True, capture_output=True
+    )
+    return pkgfile
+
+
+def rpm_header(entries, region_tag):
+    """
+    Build an RPM header structure from a list of (tag, string) entries,
+    all stored as STRING, preceded by the immutable region tag rpm
+    expects every header to start with
+    """
+
+    index = []
+    store = b""
+    for tag, value in entries:
+        index.append(struct.pack(">iiii", tag, 6, len(store), 1))
+        store += value.encode() + b"\0"
+
+    # The region trailer points back at the start of the index
+    nindex = len(entries) + 1
+    trailer = struct.pack(">iiii", region_tag, 7, -nindex * 16, 16)
+    index.insert(0, struct.pack(">iiii", region_tag, 7, len(store), 16))
+    store += trailer
+
+    return (
+        b"\x8e\xad\xe8\x01\0\0\0\0"
+        + struct.pack(">II", nindex, len(store))
+        + b"".join(index) + store
+    )
+
+
+def build_rpm(workdir):
+    """
+    Build an .rpm from the fixture tags: a lead, a signature header with
+    just a SHA256 of the main header, and the main header
+    """
+
+    header = rpm_header(
+        [(tag, RPM_TAGS[tag]) for tag in sorted(RPM_TAGS)], 63)
+    signature = rpm_header(
+        [(273, hashlib.sha256(header).hexdigest())], 62)
+    signature += b"\0" * ((8 - len(signature) % 8) % 8)
+
+    name = f"{RPM_TAGS[RPMTAG_NAME]}-{RPM_TAGS[RPMTAG_VERSION]}-" \
+        f"{RPM_TAGS[RPMTAG_RELEASE]}"
+    lead = (
+        b"\xed\xab\xee\xdb\x03\x00"
+        + struct.pack(">hh", 0, 1)
+        + name.encode().ljust(66, b"\0")[:66]
+        + struct.pack(">hh", 1, 5)
+        + b"\0" * 16
+    )
+
+    pkgfile = workdir / f"{name}.{RPM_TAGS[RPMTAG_ARCH]}.rpm"
+    pkgfile.write_bytes(lead + signature + header)
+    return pkgfile
+
+
+def test_deb(workdir):
+    if shutil.which("dpkg-deb") is None:
+        skip("all .deb tests", "dpkg-deb is not installed")
+        return
+
+    for compression in ("gzip", "xz", "zstd", "none"):
+        if compression == "zstd" and shutil.which("zstd") is None:
+            skip(f"{compression} control.tar", "zstd is not installed")
+            continue
+
+        try:
+            pkgfile = build_deb(workdir, compression)
+        except subprocess.CalledProcessError as e:
+            skip(f"{compression} control.tar",
+                 f"dpkg-deb can't build it: {e.stderr.decode().strip()}")
+            continue
+
+        fields = read_deb_control(pkgfile)
+        for field in ("Package", "Version", "Architecture", "Maintainer",
+                      "Installed-Size", "Description"):
+            want = subprocess.run(
+                ["dpkg-deb", "-f", str(pkgfile), field],
+                check=True, capture_output=True, text=True
+            ).stdout.splitlines()[0]
+            check(f"{compression} control.tar: {field}",
+                  fields.get(field), want)
+
+        check(f"{compression} control.tar: continuation lines ignored",
+              sorted(fields), sorted(
+                  ["Package", "Version", "Architecture", "Maintainer",
+                   "Installed-Size", "Description"]))
+        check(f"{compression} control.tar: package info",
+              read_package_info(pkgfile),
+              PackageInfo("couchbase-server", "7.6.2-3721", "amd64"))
+
+
+def test_rpm(workdir):
+    pkgfile = build_rpm(workdir)
+    tags = read_rpm_tags(pkgfile)
+
+    check("tags as built", {tag: tags.get(tag) for tag in RPM_TAGS},
+          RPM_TAGS)
+    check("package info", read_package_info(pkgfile),
+          PackageInfo("couchbase-server", "7.6.2-3721", "x86_64"))
+
+    if shutil.which("rpm") is None:
+        skip("comparison with rpm -qp", "rpm is not installed")
+        return
+
+    want = subprocess.run(
+        ["rpm", "-qp", "--nosignature", "--nodigest",
+         "--qf", "%{NAME}\\n%{VERSION}\\n%{RELEASE}\\n%{ARCH}\\n",
+         str(pkgfile)],
+        check=True, capture_output=True, text=True
+    ).stdout.splitlines()
+    check("tags as rpm -qp reports them",
+          [tags[tag] for tag in (RPMTAG_NAME, RPMTAG_VERSION,
+                                 RPMTAG_RELEASE, RPMTAG_ARCH)],
+          want)
+
+
+def test_errors(workdir):
+    notpkg = workdir / "notpkg.deb"
+    notpkg.write_bytes(b"not an ar archive")
+    try:
+        read_package_info(notpkg)
+        check("a non-package raises ValueError", None, "ValueError")
+    except ValueError as e:
+        check("a non-package raises ValueError, naming the file",
+              str(notpkg) in str(e), True)
+
+    truncated = workdir / "truncated.rpm"
+    truncated.write_bytes(build_rpm(workdir).read_bytes()[:200])
+    try:
+        read_package_info(truncated)
+        check("a truncated .rpm raises ValueError", None, "ValueError")
+    except ValueError:
+        check("a truncated .rpm raises ValueError", True, True)
+
+    check("nothing to read", read_all_package_info([]), {})
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = pathlib.Path(tmpdir)
+        for test in (test_deb, test_rpm, test_errors):
+            print(f"\n{test.__name__}")
+            test(workdir)
+
+    if FAILURES:
+        print(f"\n{len(FAILURES)} failure(s): {', '.join(FAILURES)}")
+        return 1
+    print("\nall pass")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
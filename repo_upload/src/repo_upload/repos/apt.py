@@ -30,13 +30,15 @@ class AptRepository(RepositoryBase):
     Manages creating and uploading APT package repositories
     """
 
-    def __init__(self, args, common_info, config_datadir, config_datafile):
+    def __init__(self, args, common_info, config_datadir, config_datafile,
+                 dry_run=False):
         """
         Load in APT-specific data from JSON file and initialize various
         common parameters and generate the Aptly configuration file
         """
 
-        super().__init__(args, common_info, config_datadir, config_datafile)
+        super().__init__(args, common_info, config_datadir, config_datafile,
+                         dry_run)
 
         data = self.load_config('apt.json')
 
@@ -307,6 +309,8 @@ class AptRepository(RepositoryBase):
         logger.debug(f'Importing into local {self.edition} repository '
                      f'at {repo_dir}')
 
+        wanted = list()
+
         for release in self.supported_releases.get_releases():
             version, status = release
 
@@ -322,35 +326,38 @@ class AptRepository(RepositoryBase):
             for distro in self.os_versions:
                 pkg_name = (f'couchbase-server-{self.edition}_{version}-'
                             f'{self.os_versions[distro]["full"]}_amd64.deb')
+                wanted.append((pkg_name, release, distro))
+
+        # Packages are downloaded concurrently, but added to aptly one at
+        # a time and in order, as they become available
+        for pkg_name, release, distro in self.fetch_packages(wanted):
+            logger.debug(
+                f'Uploading file {self.pkg_dir / pkg_name} to aptly upload area...')
+            files = {'file': open(self.pkg_dir / pkg_name, 'rb')}
+            req = requests.post(
+                f'http://localhost:8080/api/files/{self.pkg_dir}',
+                files=files
+            )
 
-                if self.fetch_package(pkg_name, release, distro):
-                    logger.debug(
-                        f'Uploading file {self.pkg_dir / pkg_name} to aptly upload area...')
-                    files = {'file': open(self.pkg_dir / pkg_name, 'rb')}
-                    req = requests.post(
-                        f'http://localhost:8080/api/files/{self.pkg_dir}',
-                        files=files
-                    )
-
-                    if req.status_code != 200:
-                        logger.fatal(
-                            f'Failed to upload file {pkg_name} to aptly '
-                            f'upload area'
-                        )
-                        exit(1)
-
-                    logger.debug(f'Adding file {pkg_name} to Debian repository '
-                                 f'{distro}')
-                    req = requests.post(
-                        f'http://localhost:8080/api/repos/{distro}/'
-                        f'file/{self.pkg_dir}/{pkg_name}'
-                    )
-
-                    if req.status_code != 200:
-                        logger.fatal(
-                            f'Failed to add file {pkg_name} to Debian repository {distro}: {req.text}'
-                        )
-                        exit(1)
+            if req.status_code != 200:
+                logger.fatal(
+                    f'Failed to upload file {pkg_name} to aptly '
+                    f'upload area'
+                )
+                exit(1)
+
+            logger.debug(f'Adding file {pkg_name} to Debian repository '
+                         f'{distro}')
+            req = requests.post(
+                f'http://localhost:8080/api/repos/{distro}/'
+                f'file/{self.pkg_dir}/{pkg_name}'
+            )
+
+            if req.status_code != 200:
+                logger.fatal(
+                    f'Failed to add file {pkg_name} to Debian repository {distro}: {req.text}'
+                )
+                exit(1)
 
     def finalize_local_repos(self):
         """
@@ -401,9 +408,32 @@ class AptRepository(RepositoryBase):
         public_repo_dists_dir.rename(self.repo_dir / 'dists')
         public_repo_pool_dir.rename(repo_pool_dir)
         public_repo_dir.rmdir()
+        self.restore_pool_mtimes(repo_pool_dir)
         logger.debug(
             f'Published local Debian repositories ready at {self.repo_dir}')
 
+    def restore_pool_mtimes(self, pool_dir):
+        """
+        The pool is published afresh on every run, so give each package
+        in it the modification time of the downloaded package it's a
+        copy of; aptly doesn't alter packages, and this way their MD5s
+        are taken from the cache rather than recomputed for the upload
+        """
+
+        for root, _, files in os.walk(pool_dir):
+            for filename in files:
+                pkg_path = Path(root) / filename
+                src_path = self.pkg_dir / filename
+
+                try:
+                    src_stat = src_path.stat()
+                except FileNotFoundError:
+                    continue
+
+                if src_stat.st_size == pkg_path.stat().st_size:
+                    os.utime(pkg_path,
+                             ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
     def upload_local_repos(self):
         """
         Upload the necessary directories from the local repositories
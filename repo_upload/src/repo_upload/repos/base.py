@@ -10,14 +10,18 @@ import hashlib
 import json
 import os
 import shutil
+import threading
+import time
 
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from pkg_resources import resource_filename
 from enum import Enum
 
 import boto3
+import boto3.s3.transfer
 import botocore.exceptions
 import gnupg
 import requests
@@ -25,6 +29,36 @@ import requests
 from .logger import logger
 
 
+# Multipart settings used for uploads to S3 (the same as boto3's
+# defaults); needed to work out the ETag S3 will give an uploaded file
+MULTIPART_THRESHOLD = 8 * 2 ** 20
+MULTIPART_CHUNKSIZE = 8 * 2 ** 20
+
+
+def file_digests(filename):
+    """
+    Generate the MD5 for a given file, along with the ETag S3 gives
+    the file when it's uploaded (in multiple parts, if it's large
+    enough); a module-level function so it can run in a process pool
+    """
+
+    hash_md5 = hashlib.md5()
+    part_md5s = list()
+
+    with open(filename, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(MULTIPART_CHUNKSIZE), b''):
+            hash_md5.update(chunk)
+            part_md5s.append(hashlib.md5(chunk).digest())
+
+    md5 = hash_md5.hexdigest()
+
+    if os.path.getsize(filename) < MULTIPART_THRESHOLD:
+        return md5, md5
+
+    etag = hashlib.md5(b''.join(part_md5s)).hexdigest()
+    return md5, f'{etag}-{len(part_md5s)}'
+
+
 class Status(Enum):
     RELEASED = 1
     DEVELOPMENT = 2
@@ -71,12 +105,14 @@ class RepositoryBase(metaclass=abc.ABCMeta):
     """
 
     @abc.abstractmethod
-    def __init__(self, edition, common_info, config_datadir, config_datafile):
+    def __init__(self, edition, common_info, config_datadir, config_datafile,
+                 dry_run=False):
         """
         Load in common data from JSON file and initialize various
         common parameters
         """
         self.config_datadir = config_datadir
+        self.dry_run = dry_run
         data = self.load_config(config_datafile)
 
         self.acl = 'private' if config_datafile == 'beta.json' else 'public-read'
@@ -101,6 +137,15 @@ class RepositoryBase(metaclass=abc.ABCMeta):
         self.pkg_dir = Path('packages')
         self.key = common_info['gpg_key']
         self.rpm_key = common_info['rpm_gpg_key']
+        self.workers = common_info.getint('workers', fallback=8)
+
+        # boto3 resources can't be shared between threads, so each
+        # download thread gets its own
+        self.thread_local = threading.local()
+
+        # MD5s of the files in the local repositories, which rarely change
+        self.md5_cache_file = self.local_repo_root / '.md5-cache.json'
+        self.md5_cache = None
 
         # The following emulates the 'date' shell command
         self.curr_date = \
@@ -141,19 +186,61 @@ class RepositoryBase(metaclass=abc.ABCMeta):
                     logger.fatal(f'Unable to import GPG key {key}')
                     exit(1)
 
-    @staticmethod
-    def get_md5(filename):
+    def get_digests(self, filenames):
         """
-        Generate the MD5 for a given file
+        Return a dictionary of filename -> (MD5, S3 ETag, size) for the
+        given files; files are hashed in a process pool, and only if
+        their size or modification time have changed since they were
+        last hashed
         """
 
-        hash_md5 = hashlib.md5()
+        if self.md5_cache is None:
+            try:
+                with open(self.md5_cache_file) as fh:
+                    self.md5_cache = json.load(fh)
+            except (FileNotFoundError, json.decoder.JSONDecodeError):
+                self.md5_cache = dict()
+
+        digests = dict()
+        stale = list()
+
+        for filename in filenames:
+            stat = os.stat(filename)
+            cached = self.md5_cache.get(filename)
+
+            if (cached is not None and cached[0] == stat.st_size
+                    and cached[1] == stat.st_mtime_ns):
+                digests[filename] = (cached[2], cached[3], stat.st_size)
+            else:
+                stale.append((filename, stat))
+
+        if stale:
+            logger.info(f'Computing MD5s for {len(stale)} files...')
 
-        with open(filename, 'rb') as fh:
-            for chunk in iter(lambda: fh.read(2 ** 20), b''):
-                hash_md5.update(chunk)
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = executor.map(
+                    file_digests, [filename for filename, _ in stale]
+                )
+
+                for (filename, stat), (md5, etag) in zip(stale, results):
+                    digests[filename] = (md5, etag, stat.st_size)
+                    self.md5_cache[filename] = \
+                        [stat.st_size, stat.st_mtime_ns, md5, etag]
+
+            # Drop entries for files which have since gone away
+            self.md5_cache = {
+                filename: entry for filename, entry in self.md5_cache.items()
+                if os.path.exists(filename)
+            }
+            os.makedirs(self.local_repo_root, exist_ok=True)
+            tmp_file = self.md5_cache_file.with_suffix('.tmp')
 
-        return hash_md5.hexdigest()
+            with open(tmp_file, 'w') as fh:
+                json.dump(self.md5_cache, fh)
+
+            tmp_file.replace(self.md5_cache_file)
+
+        return digests
 
     def write_gpg_keys(self):
         """
@@ -198,6 +285,16 @@ class RepositoryBase(metaclass=abc.ABCMeta):
 
         return
 
+    def thread_s3(self):
+        """
+        Return an S3 resource for use by the current thread
+        """
+
+        if not hasattr(self.thread_local, 's3'):
+            self.thread_local.s3 = boto3.session.Session().resource('s3')
+
+        return self.thread_local.s3
+
     def s3_download_file(self, pkg_name, os_version):
         """
         Download a given package file from S3; return success or
@@ -207,15 +304,17 @@ class RepositoryBase(metaclass=abc.ABCMeta):
         s3_path = f'{self.get_s3_path(os_version)}/{pkg_name}'
 
         logger.info(f'    Retrieving {s3_path} from {self.s3_bucket}...')
-        bucket = self.s3.Bucket(self.s3_bucket)
+        bucket = self.thread_s3().Bucket(self.s3_bucket)
+        partial = self.pkg_dir / f'{pkg_name}.part'
 
         try:
-            bucket.download_file(s3_path, f'{str(self.pkg_dir)}/{pkg_name}')
+            bucket.download_file(s3_path, str(partial))
         except botocore.exceptions.ClientError:
             logger.debug(
                 f'    Unable to retrieve {s3_path} from {self.s3_bucket}')
             return False
         else:
+            partial.rename(self.pkg_dir / pkg_name)
             return True
 
     def lb_download_file(self, pkg_name, version):
@@ -237,9 +336,14 @@ class RepositoryBase(metaclass=abc.ABCMeta):
                          f'from {release_url}')
             return False
 
-        with open(self.pkg_dir / pkg_name, 'wb') as fh:
+        # Download under a temporary name, so an interrupted download
+        # isn't later mistaken for the complete package
+        partial = self.pkg_dir / f'{pkg_name}.part'
+
+        with open(partial, 'wb') as fh:
             shutil.copyfileobj(req.raw, fh)
 
+        partial.rename(self.pkg_dir / pkg_name)
         return True
 
     def download_file(self, pkg_name, release, os_version):
@@ -275,6 +379,58 @@ class RepositoryBase(metaclass=abc.ABCMeta):
             logger.debug(f'Already have {pkg_name} locally, skipping fetch...')
             return True
 
+    def fetch_packages(self, wanted):
+        """
+        Generator to fetch a list of packages using a pool of worker
+        threads. wanted is a list of tuples, each starting with the
+        package name, release and OS version to pass to fetch_package();
+        those that are successfully fetched are yielded back in order,
+        each as soon as it's available, so the caller can import them
+        one at a time while later ones are still downloading
+        """
+
+        start = time.monotonic()
+        already_local = {
+            package[0] for package in wanted
+            if (self.pkg_dir / package[0]).exists()
+        }
+        fetched = 0
+        downloaded = 0
+        downloaded_bytes = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self.fetch_package, *package[:3])
+                for package in wanted
+            ]
+
+            try:
+                for package, future in zip(wanted, futures):
+                    if not future.result():
+                        continue
+
+                    fetched += 1
+                    if package[0] not in already_local:
+                        downloaded += 1
+                        downloaded_bytes += \
+                            (self.pkg_dir / package[0]).stat().st_size
+
+                    yield package
+            finally:
+                # If the caller bailed out, don't wait for downloads
+                # that haven't started yet
+                for future in futures:
+                    future.cancel()
+
+        elapsed = time.monotonic() - start
+        megabytes = downloaded_bytes / 2 ** 20
+        logger.info(
+            f'Imported {fetched} of {len(wanted)} packages in '
+            f'{elapsed:.1f}s; downloaded {downloaded} ({megabytes:.1f} MB, '
+            f'{megabytes / elapsed if elapsed else 0:.1f} MB/s) using '
+            f'{self.workers} workers'
+        )
+
     @abc.abstractmethod
     def import_packages(self):
         """
@@ -294,59 +450,133 @@ class RepositoryBase(metaclass=abc.ABCMeta):
 
     def s3_upload_file(self, local_path, local_path_md5, s3_path):
         """
+        Upload a single file to S3, recording its MD5 in the object's
+        metadata; safe to call from multiple threads at once
+        """
+
+        logger.info(f'  Uploading {s3_path}...')
+        obj = self.thread_s3().Object(self.s3_bucket, s3_path)
+        obj.upload_file(
+            local_path,
+            ExtraArgs={'ACL': self.acl,
+                       'Metadata': {'md5': local_path_md5}},
+            Config=boto3.s3.transfer.TransferConfig(
+                multipart_threshold=MULTIPART_THRESHOLD,
+                multipart_chunksize=MULTIPART_CHUNKSIZE
+            )
+        )
 
+    def s3_metadata_md5(self, s3_path):
+        """
+        Return the MD5 stored in the metadata of an object on S3, or
+        None if it's missing
         """
 
-        logger.info(f'Searching {s3_path} in {self.s3_bucket}')
-        obj = self.s3.Object(self.s3_bucket, s3_path)
+        obj = self.thread_s3().Object(self.s3_bucket, s3_path)
 
-        # If the loading of the object fails, it doesn't exist
-        # and the file it's connected to needs to be uploaded;
-        # otherwise check the MD5 sum stored in S3 for the file
-        # to the one locally and only upload if it's different
-        # (or the MD5 metadata is missing on S3 for that file)
         try:
             obj.load()
         except botocore.exceptions.ClientError:
-            logger.info(f'  Path {s3_path} not found, uploading...')
-            obj.upload_file(
-                local_path,
-                ExtraArgs={'ACL': self.acl,
-                           'Metadata': {'md5': local_path_md5}}
-            )
-        else:
-            logger.info(f'  Path {s3_path} exists, checking MD5...')
+            return None
 
-            if ('md5' in obj.metadata and
-                    obj.metadata['md5'] == local_path_md5):
-                logger.info(f'        It matches, skipping...')
-            else:
-                logger.info(f'        It does not exist or differs, '
-                            f'uploading...')
-                obj.upload_file(
-                    local_path,
-                    ExtraArgs={'ACL': self.acl,
-                               'Metadata': {'md5': local_path_md5}}
-                )
+        return obj.metadata.get('md5')
+
+    def list_s3_objects(self, prefix):
+        """
+        Return a dictionary of key -> (size, ETag) for all objects
+        under a given prefix on S3
+        """
+
+        objects = dict()
+        paginator = self.s3.meta.client.get_paginator('list_objects_v2')
+
+        for page in paginator.paginate(Bucket=self.s3_bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                objects[obj['Key']] = (obj['Size'], obj['ETag'].strip('"'))
+
+        return objects
 
     def s3_upload(self, base_dir, rel_base_dir):
         """
-        Upload a given directory tree to S3; uses additional metadata
-        to maintain an MD5 for each file to prevent unnecessary uploads
-        and speed up the synchronization
+        Upload a given directory tree to S3. The existing objects are
+        found with a single listing, and a file is only uploaded if it
+        is missing or its size or ETag differ; when the ETag can't be
+        compared, the MD5 stored in the object's metadata is checked
+        instead. Uploads are run concurrently, or just summarized if
+        this is a dry run
         """
 
         logger.debug(f'Uploading {base_dir} -> {rel_base_dir}')
 
+        s3_prefix = os.path.join(self.s3_package_base, rel_base_dir)
+        local_files = dict()
+
         for root, dirs, files in os.walk(base_dir):
             for filename in files:
                 local_path = os.path.join(root, filename)
-                local_path_md5 = self.get_md5(local_path)
                 relative_path = os.path.relpath(local_path, base_dir)
-                s3_path = os.path.join(
-                    self.s3_package_base, rel_base_dir, relative_path
+                local_files[os.path.join(s3_prefix, relative_path)] = \
+                    local_path
+
+        digests = self.get_digests(list(local_files.values()))
+        s3_objects = self.list_s3_objects(f'{s3_prefix}/')
+
+        new = list()
+        changed = list()
+        unknown = list()
+        unchanged = 0
+
+        for s3_path, local_path in sorted(local_files.items()):
+            md5, etag, size = digests[local_path]
+
+            if s3_path not in s3_objects:
+                new.append(s3_path)
+            elif s3_objects[s3_path][0] != size:
+                changed.append(s3_path)
+            elif s3_objects[s3_path][1] in (md5, etag):
+                unchanged += 1
+            else:
+                unknown.append(s3_path)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            remote_md5s = executor.map(self.s3_metadata_md5, unknown)
+
+            for s3_path, remote_md5 in zip(unknown, remote_md5s):
+                if remote_md5 == digests[local_files[s3_path]][0]:
+                    unchanged += 1
+                else:
+                    changed.append(s3_path)
+
+        uploads = new + sorted(changed)
+        upload_bytes = sum(digests[local_files[s3_path]][2]
+                           for s3_path in uploads)
+
+        for s3_path in new:
+            logger.debug(f'  new:     {s3_path}')
+        for s3_path in sorted(changed):
+            logger.debug(f'  changed: {s3_path}')
+        logger.info(
+            f'{rel_base_dir}: {len(new)} new, {len(changed)} changed, '
+            f'{unchanged} unchanged; {upload_bytes / 2 ** 20:.1f} MB '
+            f'to upload'
+        )
+
+        if self.dry_run:
+            logger.info('  Dry run, skipping upload')
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(
+                    self.s3_upload_file, local_files[s3_path],
+                    digests[local_files[s3_path]][0], s3_path
                 )
-                self.s3_upload_file(local_path, local_path_md5, s3_path)
+                for s3_path in uploads
+            ]
+
+            # Raise any upload failure here
+            for future in futures:
+                future.result()
 
     @abc.abstractmethod
     def upload_local_repos(self):
@@ -25,13 +25,15 @@ class YumRepository(RepositoryBase):
     Manages creating and uploading APT package repositories
     """
 
-    def __init__(self, args, common_info, config_datadir, config_datafile):
+    def __init__(self, args, common_info, config_datadir, config_datafile,
+                 dry_run=False):
         """
         Load in Yum-specific data from JSON file and initialize various
         common parameters
         """
 
-        super().__init__(args, common_info, config_datadir, config_datafile)
+        super().__init__(args, common_info, config_datadir, config_datafile,
+                         dry_run)
 
         self.os_versions = list(self.get_versions())
         self.repo_dir = self.local_repo_root / self.edition
@@ -229,6 +231,8 @@ class YumRepository(RepositoryBase):
         logger.info(
             f'Importing into local {self.edition} repositories at {self.repo_dir}')
 
+        wanted = list()
+
         for release in self.supported_releases.get_releases():
             version, status = release
 
@@ -244,17 +248,38 @@ class YumRepository(RepositoryBase):
                     continue
                 pkg_name = (f'couchbase-server-{self.edition}-{version}-'
                             f'{distro}{distro_version}.x86_64.rpm')
+                wanted.append((pkg_name, release,
+                               f'{self.path_partial(distro)}/{version}',
+                               distro, distro_version))
+
+        # Packages are downloaded concurrently, but copied and signed one
+        # at a time and in order, as they become available
+        for pkg_name, _, _, distro, distro_version in \
+                self.fetch_packages(wanted):
+            pkg_basepath = self.repo_dir / \
+                self.path_partial(distro) / distro_version / 'x86_64'
+            pkg_path = pkg_basepath / pkg_name
+
+            # A signed copy no older than the downloaded package is left
+            # from a previous run; leaving it alone (rather than copying
+            # and signing it again) keeps its modification time, so its
+            # MD5 needn't be recomputed for the upload
+            if (pkg_path.exists() and
+                    pkg_path.stat().st_mtime_ns >=
+                    (self.pkg_dir / pkg_name).stat().st_mtime_ns and
+                    self.is_signed(pkg_path)):
+                logger.debug(f'    {pkg_path} is already signed, skipping...')
+                continue
 
-                if self.fetch_package(pkg_name, release, f'{self.path_partial(distro)}/{version}'):
-                    logger.info(
-                        f'    Copying file {pkg_name} to RedHat repository '
-                        f'{self.path_partial(distro)}/{distro_version}/x86_64...'
-                    )
-                    pkg_basepath = self.repo_dir / \
-                        self.path_partial(distro) / distro_version / 'x86_64'
-                    shutil.copy(self.pkg_dir / pkg_name, pkg_basepath)
-                    if not self.is_signed(pkg_basepath / pkg_name):
-                        self.sign_rpm(pkg_basepath / pkg_name)
+            logger.info(
+                f'    Copying file {pkg_name} to RedHat repository '
+                f'{self.path_partial(distro)}/{distro_version}/x86_64...'
+            )
+            # copy2() keeps the modification time, so a copy of a package
+            # which is already signed is as new as the package itself
+            shutil.copy2(self.pkg_dir / pkg_name, pkg_basepath)
+            if not self.is_signed(pkg_path):
+                self.sign_rpm(pkg_path)
 
         logger.info(f'RedHat repositories ready for signing')
 
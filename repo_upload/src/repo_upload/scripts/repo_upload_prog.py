@@ -49,6 +49,9 @@ def main():
     parser.add_argument('-e', '--edition', required=True,
                         choices=['community', 'enterprise'],
                         help='Version of software being uploaded')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='Build the local repositories and report what '
+                             'would change on S3, without uploading')
 
     args = parser.parse_args()
     # Set logging to debug level on stream handler if --debug was set
@@ -103,7 +106,8 @@ def main():
 
     try:
         upload = getattr(mod, upload_class)(
-            args.edition, common_info, config_datadir, args.config_datafile
+            args.edition, common_info, config_datadir, args.config_datafile,
+            args.dry_run
         )
         upload.update_repository()
     except RuntimeError as exc:
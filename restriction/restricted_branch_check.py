@@ -3,9 +3,12 @@
 import argparse
 import base64
 import html
+import json
 import os
 import re
+import subprocess
 import sys
+import tempfile
 import urllib
 
 from jira_util import connect_jira, get_tickets
@@ -14,7 +17,7 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 build_from_manifest_path = os.path.abspath(os.path.join(script_dir, "..", "build-from-manifest"))
 if build_from_manifest_path not in sys.path:
     sys.path.insert(0, build_from_manifest_path)
-from manifest_util import scan_manifests
+from manifest_util import get_metadata_for_products, sync_manifest_repo
 
 """
 Intended to run as a Gerrit trigger or github action.
@@ -38,9 +41,21 @@ COMMIT_MSG = None
 # Values for outputting in HTML template (initialized later)
 OUTPUT = {}
 
+# Jira state for the run: a single session shared by the checks of every
+# restricted manifest, plus the approval-ticket links and ticket labels
+# already fetched through it
+JIRA_SESSION = None
+APPROVED_TICKETS = {}
+TICKET_LABELS = {}
+
 # Name for output HTML file
 html_filename = "restricted.html"
 
+# Name of the restricted-manifest index, kept in the manifest repository's
+# git dir. Bump the version when its layout changes.
+index_filename = "restricted-index.json"
+index_version = 1
+
 
 def sanitize_for_template(value):
     """
@@ -122,19 +137,16 @@ def setup_environment():
     OUTPUT.update(globals())
 
 
-def check_branch_in_manifest(meta):
+def get_project_branch(manifest_et, project):
     """
-    Returns true if the PRODUCT/BRANCH are listed in the named manifest
+    Returns the branch of the named project in a manifest, or None if the
+    project isn't in it
     """
-    print(f"Checking manifest {meta['manifest_path']}")
-
-    manifest_et = meta["_manifest"]
-    project_et = manifest_et.find("./project[@name='{}']".format(PROJECT))
+    project_et = manifest_et.find("./project[@name='{}']".format(project))
     if project_et is None:
-        project_et = manifest_et.find("./extend-project[@name='{}']".format(PROJECT))
+        project_et = manifest_et.find("./extend-project[@name='{}']".format(project))
         if project_et is None:
-            print("project {} not found".format(PROJECT))
-            return False
+            return None
 
     # Compute the default branch for the manifest
     default_branch = "master"
@@ -143,13 +155,131 @@ def check_branch_in_manifest(meta):
         default_branch = default_et.get("branch", "master")
 
     # Pull out the branch for the given project
-    project_branch = project_et.get("revision", default_branch)
-    if project_branch != BRANCH:
-        print("project {} on branch {}, not {}".format(
-            PROJECT, project_branch, BRANCH)
+    return project_et.get("revision", default_branch)
+
+
+def build_restricted_index(manifests):
+    """
+    Builds an index of which restricted manifests each project/branch is
+    in, so that checking a change needs no manifest parsing at all.
+    Returns a dict with:
+      "manifests": metadata of every restricted manifest, keyed by path
+      "branches": project -> branch -> list of restricted manifests
+      "no_approval": restricted manifests with no approval ticket
+    """
+    index = {"manifests": {}, "branches": {}, "no_approval": []}
+    for manifest, meta in manifests.items():
+        if not meta.get("restricted"):
+            continue
+        if meta.get("approval_ticket") is None:
+            index["no_approval"].append(manifest)
+            continue
+
+        index["manifests"][manifest] = {
+            key: value for key, value in meta.items() if key != "_manifest"
+        }
+        manifest_et = meta["_manifest"]
+        unrestricted_projects = meta.get("unrestricted_projects", [])
+        projects = {
+            project_et.get("name")
+            for project_et in manifest_et.findall("./project")
+            + manifest_et.findall("./extend-project")
+        }
+        for project in sorted(projects - set(unrestricted_projects)):
+            branch = get_project_branch(manifest_et, project)
+            index["branches"].setdefault(project, {}) \
+                .setdefault(branch, []).append(manifest)
+    return index
+
+
+def load_restricted_index(manifest_project):
+    """
+    Syncs the manifest repository and returns the restricted-manifest
+    index for its current HEAD, building it only if the one saved on disk
+    is for a different commit
+    """
+    manifest_dir = sync_manifest_repo(manifest_project)
+    try:
+        git_dir, head = subprocess.check_output(
+            ["git", "rev-parse", "--absolute-git-dir", "HEAD"],
+            cwd=manifest_dir, text=True
+        ).split()
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        git_dir = head = None
+
+    if head is not None:
+        index_path = os.path.join(git_dir, index_filename)
+        try:
+            with open(index_path) as index_file:
+                index = json.load(index_file)
+            if index.get("head") == head and index.get("version") == index_version:
+                print(f"Using restricted-manifest index for {head}")
+                return index
+        except (OSError, ValueError):
+            pass
+
+    print("Building restricted-manifest index")
+    index = build_restricted_index(get_metadata_for_products(manifest_dir))
+    if head is not None:
+        index["head"] = head
+        index["version"] = index_version
+        fd, tmp_path = tempfile.mkstemp(dir=git_dir, prefix=index_filename)
+        with os.fdopen(fd, "w") as index_file:
+            json.dump(index, index_file)
+        os.replace(tmp_path, index_path)
+    return index
+
+
+def get_jira():
+    """
+    Returns the Jira session for this run, connecting the first time
+    """
+    global JIRA_SESSION
+    if JIRA_SESSION is None:
+        JIRA_SESSION = connect_jira()
+    return JIRA_SESSION
+
+
+def search_tickets(tickets, fields, jira):
+    """
+    Fetches the given fields of several Jira tickets with a single search,
+    returning a dict of ticket ID to issue. Tickets that don't exist (or
+    have since moved) are simply left out, as is everything if the search
+    itself fails; callers fetch anything missing one at a time.
+    """
+    try:
+        issues = jira.search_issues(
+            "key in ({})".format(", ".join(tickets)),
+            fields=fields, maxResults=len(tickets), validate_query=False
         )
-        return False
-    return True
+    except Exception as e:
+        print(f"Jira search for {', '.join(tickets)} failed: {e}")
+        return {}
+    return {issue.key: issue for issue in issues if issue.key in tickets}
+
+
+def fetch_ticket_labels(tickets, jira):
+    """
+    Ensures the labels of all the given tickets are in TICKET_LABELS
+    """
+    wanted = sorted(set(tickets) - set(TICKET_LABELS))
+    if not wanted:
+        return
+    for ticket, issue in search_tickets(wanted, "labels", jira).items():
+        TICKET_LABELS[ticket] = issue.raw['fields'].get('labels') or []
+    for ticket in wanted:
+        if ticket in TICKET_LABELS:
+            continue
+        try:
+            jira_ticket = jira.issue(ticket, fields="labels")
+            TICKET_LABELS[ticket] = jira_ticket.raw['fields']['labels']
+        except Exception as e:
+            # If the above jira call failed, it was most likely due to the
+            # message naming a non-existent ticket eg. due to a typo or
+            # similar. We don't want to fail with an error about retrieving
+            # labels; just assume the non-existent ticket didn't have any of
+            # the approved labels.
+            TICKET_LABELS[ticket] = []
 
 
 def can_bypass_restriction(ticket, jira):
@@ -163,34 +293,52 @@ def can_bypass_restriction(ticket, jira):
         'test-change-only',
         'analytics-compat-jars'
     ]
-    try:
-        jira_ticket = jira.issue(ticket)
-        return any(label in bypass_labels for label in jira_ticket.raw['fields']['labels'])
-    except Exception as e:
-        # If the above jira call failed, it was most likely due to the
-        # message naming a non-existent ticket eg. due to a typo or
-        # similar. We don't want to fail with an error about retrieving
-        # labels; just assume the non-existent ticket didn't have any of
-        # the approved labels.
-        return False
+    fetch_ticket_labels([ticket], jira)
+    return any(label in bypass_labels for label in TICKET_LABELS[ticket])
+
+
+def linked_tickets(approval_ticket, jira_ticket):
+    """
+    Given a fetched Jira approval ticket, return all linked ticket IDs
+    """
+    depends = [
+        link.outwardIssue.key for link in jira_ticket.fields.issuelinks
+        if hasattr(link, "outwardIssue")
+    ]
+    relates = [
+        link.inwardIssue.key for link in jira_ticket.fields.issuelinks
+        if hasattr(link, "inwardIssue")
+    ]
+    subtasks = [subtask.key for subtask in jira_ticket.fields.subtasks]
+    return depends + relates + subtasks + [approval_ticket]
+
+
+def prefetch_approved_tickets(approval_tickets, jira):
+    """
+    Fetches the links of several approval tickets with a single search,
+    saving them in APPROVED_TICKETS
+    """
+    wanted = sorted(set(approval_tickets) - set(APPROVED_TICKETS))
+    if not wanted:
+        return
+    for ticket, issue in search_tickets(
+        wanted, "issuelinks,subtasks", jira
+    ).items():
+        APPROVED_TICKETS[ticket] = linked_tickets(ticket, issue)
 
 
 def get_approved_tickets(approval_ticket, jira):
     """
     Given a Jira approval ticket ID, return all linked ticket IDs
     """
+    if approval_ticket in APPROVED_TICKETS:
+        return APPROVED_TICKETS[approval_ticket]
     try:
         jira_ticket = jira.issue(approval_ticket)
-        depends = [
-            link.outwardIssue.key for link in jira_ticket.fields.issuelinks
-            if hasattr(link, "outwardIssue")
-        ]
-        relates = [
-            link.inwardIssue.key for link in jira_ticket.fields.issuelinks
-            if hasattr(link, "inwardIssue")
-        ]
-        subtasks = [subtask.key for subtask in jira_ticket.fields.subtasks]
-        return depends + relates + subtasks + [approval_ticket]
+        APPROVED_TICKETS[approval_ticket] = linked_tickets(
+            approval_ticket, jira_ticket
+        )
+        return APPROVED_TICKETS[approval_ticket]
     except Exception as e:
         # Error handling in connect_jira handles auth issues
         if "404" in str(e) or "does not exist" in str(e):
@@ -200,13 +348,10 @@ def get_approved_tickets(approval_ticket, jira):
             raise
 
 
-def validate_change_in_ticket(meta):
+def get_fix_tickets():
     """
-    Checks the commit message for a ticket name, and verifies it with the the
-    approval ticket for the restricted manifest
+    Returns the tickets named by the commit message
     """
-    global COMMIT_MSG
-    approval_ticket = meta.get("approval_ticket")
     # We require a ticket to be named either on the first line of the
     # commit message OR in an Ext-ref: footer line. For the time being
     # we don't enforce footers being at the end of the commit message;
@@ -215,17 +360,33 @@ def validate_change_in_ticket(meta):
     for i, line in enumerate(COMMIT_MSG.split('\n')):
         if i == 0 or line.startswith("Ext-ref:"):
             msg_lines += f"{line}\n"
-    fix_tickets = get_tickets(msg_lines)
+    return get_tickets(msg_lines)
+
+
+def validate_change_in_ticket(meta):
+    """
+    Checks the commit message for a ticket name, and verifies it with the the
+    approval ticket for the restricted manifest
+    """
+    approval_ticket = meta.get("approval_ticket")
+    fix_tickets = get_fix_tickets()
     if len(fix_tickets) == 0:
         OUTPUT["REASON"] = "the commit message does not name a ticket"
         return False
 
     # Now get list of approved tickets from approval ticket, and ensure
     # all "fixed" tickets are approved.
-    jira = connect_jira()
+    jira = get_jira()
     approved_tickets = get_approved_tickets(approval_ticket, jira)
-    for tick in fix_tickets:
-        if tick not in approved_tickets and not can_bypass_restriction(tick, jira):
+    unapproved_tickets = [
+        tick for tick in fix_tickets if tick not in approved_tickets
+    ]
+    # Fetch labels for every named ticket at once, as other restricted
+    # manifests may need the ones this one doesn't
+    if unapproved_tickets:
+        fetch_ticket_labels(fix_tickets, jira)
+    for tick in unapproved_tickets:
+        if not can_bypass_restriction(tick, jira):
             # Ok, this fixed ticket isn't approved in approval ticket
             # nor does it contain a label for bypassing this check.
             # Populate the OUTPUT map for the HTML and email templates.
@@ -460,34 +621,19 @@ def real_main():
     if os.path.exists(html_filename):
         os.remove(html_filename)
 
-    # Collect all restricted manifests that reference this branch
-    manifests = scan_manifests(manifest_project)
-    restricted_manifests = []
-    for manifest in manifests:
-        meta = manifests[manifest]
-        if meta.get("restricted"):
-            approval_ticket = meta.get("approval_ticket")
-            if approval_ticket is None:
-                print("no approval ticket for restricted manifest {}".format(
-                    manifest
-                ))
-                continue
-
-            # Also see if projects are specifically excluded from check for this manifest
-            unrestricted_projects = meta.get("unrestricted_projects", [])
-            if PROJECT in unrestricted_projects:
-                print("Project {} is unrestricted in manifest {}".format(
-                    PROJECT, manifest
-                ))
-                continue
-
-            if not check_branch_in_manifest(meta):
-                continue
-
-            # Ok, this proposal is to a branch in a restricted manifest
-            restricted_manifests.append(manifest)
-            print("Project: {} Branch: {} is in restricted manifest: "
-                  "{}".format(PROJECT, BRANCH, manifest))
+    # Collect all restricted manifests that reference this branch. The
+    # index already leaves out manifests in which the project is
+    # specifically excluded from the check
+    index = load_restricted_index(manifest_project)
+    for manifest in index["no_approval"]:
+        print("no approval ticket for restricted manifest {}".format(
+            manifest
+        ))
+    manifests = index["manifests"]
+    restricted_manifests = index["branches"].get(PROJECT, {}).get(BRANCH, [])
+    for manifest in restricted_manifests:
+        print("Project: {} Branch: {} is in restricted manifest: "
+              "{}".format(PROJECT, BRANCH, manifest))
 
     # Now *remove* any restricted manifests that are the parent of any other
     # restricted manifests in the list. Logic: if a change is approved for a
@@ -505,7 +651,14 @@ def real_main():
             restricted_children.remove(parent)
 
     # Now, iterate through all restricted manifests that we have left,
-    # and ensure this ticket is approved for each.
+    # and ensure this ticket is approved for each. Their approval tickets
+    # are all fetched up front in one go.
+    if restricted_children and get_fix_tickets():
+        prefetch_approved_tickets(
+            [manifests[manifest]["approval_ticket"]
+             for manifest in restricted_children],
+            get_jira()
+        )
     for manifest in restricted_children:
         if not validate_change_in_ticket(manifests[manifest]):
             OUTPUT["MANIFEST"] = manifest
@@ -1,74 +1,231 @@
 #!/usr/bin/env python3.6
 
-# Simple program to take a set of files on AWS S3, download them,
-# calculate their MD5 sums, and re-upload them with the sum included
-# in their metadata
+# Simple program to take a set of files on AWS S3, calculate their MD5
+# sums, and add the sum to their metadata. Single-part uploads already
+# carry their MD5 as the ETag; anything else is hashed by streaming it
+# from S3. The metadata is then replaced with a server-side copy of the
+# object onto itself, so no object body is ever re-uploaded.
 
+import argparse
 import hashlib
-import os
 import sys
+import threading
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import boto3
 import botocore.exceptions
+import urllib3.exceptions
+from boto3.s3.transfer import TransferConfig
+
+
+# copy_object() can only handle objects up to 5GB; anything larger has to
+# be copied in parts, which the managed copy() does for us
+MAX_COPY_OBJECT_SIZE = 5 * 1024 ** 3
+
+# Headers which are dropped by a copy with MetadataDirective=REPLACE
+# unless passed again
+PRESERVED_HEADERS = [
+    'CacheControl', 'ContentDisposition', 'ContentEncoding',
+    'ContentLanguage', 'ContentType', 'Expires', 'WebsiteRedirectLocation',
+]
+
+# Server-side encryption settings, which a copy also doesn't keep unless
+# passed again
+ENCRYPTION_HEADERS = ['ServerSideEncryption', 'SSEKMSKeyId', 'BucketKeyEnabled']
+
+# Errors talking to S3 which should only fail the object at hand: those
+# S3 returns, those botocore raises for connection problems and timeouts,
+# and those urllib3 can raise part-way through streaming a body
+S3_ERRORS = (
+    botocore.exceptions.ClientError,
+    botocore.exceptions.BotoCoreError,
+    urllib3.exceptions.HTTPError,
+)
 
+print_lock = threading.Lock()
 
-def get_md5(filename):
+
+def log(msg):
     """
-    Generate the MD5 for a given file
+    Print a message without interleaving output from other threads
     """
 
+    with print_lock:
+        print(msg, flush=True)
+
+
+def get_md5(s3, bucket, key, head):
+    """
+    Determine the MD5 for a given object, using its ETag if that's
+    known to be the MD5, else streaming the object through hashlib
+    """
+
+    etag = head['ETag'].strip('"')
+
+    # Multipart uploads have an ETag of the form <hash>-<parts>, and
+    # objects encrypted with KMS keys have an ETag which isn't their MD5
+    if '-' not in etag and head.get('ServerSideEncryption') != 'aws:kms':
+        return etag
+
     hash_md5 = hashlib.md5()
+    body = s3.get_object(Bucket=bucket, Key=key, IfMatch=head['ETag'])['Body']
 
-    with open(filename, 'rb') as fh:
-        for chunk in iter(lambda: fh.read(2 ** 20), b''):
-            hash_md5.update(chunk)
+    for chunk in body.iter_chunks(2 ** 20):
+        hash_md5.update(chunk)
 
     return hash_md5.hexdigest()
 
 
-def add_md5_to_s3(s3_key):
+def add_md5_to_s3(s3, bucket, key, transfer_config):
     """
-    Download given file from given bucket, calculate its MD5 hash,
-    then re-upload it with the MD5 in the metadata
+    Calculate the MD5 hash of the given object, then copy the object
+    onto itself with the MD5 added to the metadata. Returns True if the
+    object has MD5 metadata when done.
     """
 
-    filename = s3_key.split('/')[-1]
-
     try:
-        s3_bucket.download_file(s3_key, filename)
-    except botocore.exceptions.ClientError:
-        print(f'  Unable to retrieve {s3_key} from {s3_bucket}')
-        return
+        head = s3.head_object(Bucket=bucket, Key=key)
+    except S3_ERRORS as exc:
+        log(f'  Unable to retrieve {key} from {bucket}: {exc}')
+        return False
 
-    md5_hash = get_md5(filename)
-    obj = s3.Object(s3_bucket.name, s3_key)
+    metadata = head.get('Metadata', {})
+    if 'md5' in metadata:
+        log(f'{key} already has MD5 metadata')
+        return True
 
-    try:
-        obj.upload_file(
-            filename,
-            ExtraArgs={'ACL': 'public-read', 'Metadata': {'md5': md5_hash}}
-        )
-    except botocore.exceptions.ClientError:
-        print(f'  Unable to upload {filename} to {s3_bucket} at {s3_key}')
-        return
+    log(f'Updating {key} to have MD5 metadata')
 
     try:
-        os.remove(filename)
-    except FileNotFoundError:
-        pass
+        metadata['md5'] = get_md5(s3, bucket, key, head)
+    except S3_ERRORS as exc:
+        log(f'  Unable to retrieve {key} from {bucket}: {exc}')
+        return False
+
+    extra_args = {
+        'ACL': 'public-read',
+        'Metadata': metadata,
+        'MetadataDirective': 'REPLACE',
+        # Don't clobber the object if it changed since we hashed it
+        'CopySourceIfMatch': head['ETag'],
+    }
+    for header in PRESERVED_HEADERS:
+        if header in head:
+            extra_args[header] = head[header]
+    # StorageClass is only returned for non-STANDARD objects, and would
+    # otherwise revert to STANDARD on copy
+    if 'StorageClass' in head:
+        extra_args['StorageClass'] = head['StorageClass']
+    # Likewise the copy would get the bucket's default encryption, losing
+    # the KMS key of any object encrypted with one
+    for header in ENCRYPTION_HEADERS:
+        if header in head:
+            extra_args[header] = head[header]
+
+    copy_source = {'Bucket': bucket, 'Key': key}
 
+    try:
+        if head['ContentLength'] <= MAX_COPY_OBJECT_SIZE:
+            s3.copy_object(
+                CopySource=copy_source, Bucket=bucket, Key=key, **extra_args
+            )
+        else:
+            s3.copy(
+                copy_source, bucket, key,
+                ExtraArgs=extra_args, Config=transfer_config
+            )
+    except S3_ERRORS as exc:
+        log(f'  Unable to update metadata of {key} in {bucket}: {exc}')
+        return False
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Add MD5 metadata to all objects under an S3 path'
+    )
+    parser.add_argument('bucket', help='S3 bucket')
+    parser.add_argument('base_path', help='S3 base path')
+    parser.add_argument('-j', '--jobs', type=int, default=16,
+                        help='Number of objects to process concurrently')
+    parser.add_argument('--resume-file',
+                        help='File listing keys already done; keys are '
+                             'appended as they complete, and skipped '
+                             'without even a HEAD request when re-run')
+    args = parser.parse_args()
+
+    s3_base_path = args.base_path
+    if not s3_base_path.endswith('/'):
+        s3_base_path += '/'
+
+    done = set()
+    if args.resume_file:
+        try:
+            with open(args.resume_file) as fh:
+                done.update(line.rstrip('\n') for line in fh)
+        except FileNotFoundError:
+            pass
+        print(f'Skipping {len(done)} objects listed in {args.resume_file}')
+
+    # Clients, unlike resources, are safe to share between threads
+    s3 = boto3.client('s3')
+    transfer_config = TransferConfig(max_concurrency=4)
+
+    resume_fh = open(args.resume_file, 'a') if args.resume_file else None
+    resume_lock = threading.Lock()
+
+    def process(key):
+        if not add_md5_to_s3(s3, args.bucket, key, transfer_config):
+            return False
+        if resume_fh is not None:
+            with resume_lock:
+                resume_fh.write(f'{key}\n')
+                resume_fh.flush()
+        return True
+
+    paginator = s3.get_paginator('list_objects_v2')
+    keys = (
+        obj['Key']
+        for page in paginator.paginate(Bucket=args.bucket, Prefix=s3_base_path)
+        for obj in page.get('Contents', [])
+        if obj['Key'] not in done
+    )
+
+    processed = 0
+    failures = 0
+
+    def collect(futures):
+        nonlocal processed, failures
+        for future in futures:
+            processed += 1
+            if not future.result():
+                failures += 1
+
+    # Only a few batches of objects are queued at once, rather than a
+    # future for every key in the bucket
+    max_pending = args.jobs * 4
 
-if len(sys.argv) != 3:
-    print(f'Usage: {sys.argv[0]} <S3 bucket> <S3 base path>')
-    sys.exit(1)
-
-s3 = boto3.resource('s3')
-s3_bucket = s3.Bucket(sys.argv[1])
-s3_base_path = sys.argv[2]
-
-if not s3_base_path.endswith('/'):
-    s3_base_path += '/'
-
-for obj in s3_bucket.objects.filter(Prefix=s3_base_path):
-    print(f'Updating {obj.key} to have MD5 metadata')
-    add_md5_to_s3(obj.key)
+    try:
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            pending = set()
+            for key in keys:
+                if len(pending) >= max_pending:
+                    done_futures, pending = wait(
+                        pending, return_when=FIRST_COMPLETED
+                    )
+                    collect(done_futures)
+                pending.add(executor.submit(process, key))
+            collect(wait(pending).done)
+    finally:
+        if resume_fh is not None:
+            resume_fh.close()
+        print(f'Processed {processed} objects, {failures} failed')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()